@@ -9,28 +9,39 @@ and providing tools for handling errors and exceptions that may occur when calli
 """
 
 import ctypes
+import json
 import os
 import re
 import sys
+import tempfile
 import warnings
 from ctypes.util import find_library
 
-import importlib.metadata
-from importlib.metadata import PackageNotFoundError
+# python-clang and the code generator are imported, and the clang library configured, on first use
+cindex = None
+__clang_py_version__ = None
+__clang_configured = False
+__clang_library_filename = None
+__clang_library_version = None
+# attributes imported on first access, by __getattr__
+__codegenerator_api = ('translate', 'translate_files', 'translate_to_code', 'translate_files_to_code')
 
-try:
-    __version__ = importlib.metadata.version('ctypeslib22')
-except PackageNotFoundError:
-    __version__ = 'Please install the latest version of this python package'
+
+def __package_version():
+    import importlib.metadata
+    try:
+        return importlib.metadata.version('ctypeslib22')
+    except importlib.metadata.PackageNotFoundError:
+        return 'Please install the latest version of this python package'
 
 
 def __find_clang_libraries():
     """ configure python-clang to use the local clang library """
     _libs = []
     # try for a file with a version match with the clang python package version
-    version_major = __clang_py_version__.split('.')[0]
+    version_major = clang_py_version().split('.')[0]
     # try default system name
-    v_list = [f"clang-{__clang_py_version__}", f"clang-{version_major}", "libclang", "clang"]
+    v_list = [f"clang-{clang_py_version()}", f"clang-{version_major}", "libclang", "clang"]
     # tries clang version 16 to 7
     v_list += [f"clang-{_}" for _ in range(16, 6, -1)]
     # with the dotted form of clang 6.0 to 4.0
@@ -53,6 +64,7 @@ def __find_clang_libraries():
 
 def clang_version():
     """Pull the clang C library version from the API"""
+    _configure_clang()
     # avoid loading the cindex API (cindex.conf.lib) to avoid version conflicts
     get_version = cindex.conf.get_cindex_library().clang_getClangVersion
     get_version.restype = ctypes.c_char_p
@@ -67,25 +79,133 @@ def clang_version():
 
 def clang_py_version():
     """Return the python clang package version"""
+    global __clang_py_version__
+    if __clang_py_version__ is None:
+        import importlib.metadata
+        __clang_py_version__ = importlib.metadata.version('clang')
     return __clang_py_version__
 
 
+# the dynamic linker cache, find_library results change with it
+__LD_SO_CACHE = '/etc/ld.so.cache'
+
+
+def __discovery_cache_filename():
+    """The file caching the discovered clang library, or None if disabled"""
+    filename = os.environ.get('CTYPESLIB_LIBCLANG_CACHE')
+    if filename is not None:
+        return filename or None
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'ctypeslib', 'libclang.json')
+
+
+def __mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+# the environment variables find_library and the discovery depend on
+__DISCOVERY_ENVIRON = ['CLANG_LIBRARY_PATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH', 'LIBRARY_PATH', 'PATH']
+
+
+def __discovery_key():
+    """
+    What the discovery depends on, besides the files themselves: the environment, and the
+    modification times of the directories searched, that change when a library is added to them
+    """
+    environ = [os.environ.get(name) for name in __DISCOVERY_ENVIRON]
+    directories = []
+    for name in ['LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH', 'LIBRARY_PATH']:
+        directories.extend(d for d in os.environ.get(name, '').split(os.pathsep) if d)
+    return [clang_py_version(), sys.platform, environ, [[d, __mtime(d)] for d in directories]]
+
+
+def __load_discovery_cache():
+    """
+    Returns the cached (library path, version) of the clang library, (None, None) if the discovery
+    found nothing, or None if there is no valid cached result.
+    The library path is valid while its modification time is unchanged, a negative result while
+    the dynamic linker cache is unchanged.
+    """
+    filename = __discovery_cache_filename()
+    if filename is None:
+        return None
+    try:
+        with open(filename) as f:
+            cache = json.load(f)
+        if cache['key'] != __discovery_key():
+            return None
+        if cache['path'] is None:
+            valid = cache['mtime'] == __mtime(__LD_SO_CACHE)
+        else:
+            valid = cache['mtime'] == __mtime(cache['path'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if not valid:
+        return None
+    return cache['path'], cache['version']
+
+
+def __save_discovery_cache(library_path, version):
+    filename = __discovery_cache_filename()
+    if filename is None:
+        return
+    mtime = __mtime(__LD_SO_CACHE if library_path is None else library_path)
+    cache = {'key': __discovery_key(), 'path': library_path, 'mtime': mtime, 'version': version}
+    try:
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', prefix='.libclang')
+    except OSError:
+        # the cache is an optimization, a read-only home is not an error
+        return
+    try:
+        with os.fdopen(handle, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temporary, filename)
+    except OSError:
+        os.unlink(temporary)
+
+
 def __configure_clang_cindex():
     """
     First we attempt to configure clang with the library path set in environment variable
     Second we attempt to configure clang with a clang library version similar to the clang python package version
     Third we attempt to configure clang with any clang library we can find
+
+    The result is cached on disk, and the cached library is used without searching nor loading it.
+    Returns the library path and its version.
     """
+    cached = __load_discovery_cache()
+    if cached is not None:
+        library_path, version = cached
+        if library_path is not None:
+            if os.path.isdir(library_path):
+                cindex.Config.set_library_path(library_path)
+            else:
+                cindex.Config.set_library_file(library_path)
+        return library_path, version
+    library_path = __search_clang_cindex()
+    version = clang_version() if library_path is not None else None
+    __save_discovery_cache(library_path, version)
+    return library_path, version
+
+
+def __candidate_clang_libraries():
     # first, use environment variables set by user
-    __libs = []
     __lib_path = os.environ.get('CLANG_LIBRARY_PATH')
     if __lib_path is not None:
         if not os.path.exists(__lib_path):
             warnings.warn("Filepath in CLANG_LIBRARY_PATH does not exist", RuntimeWarning)
         else:
-            __libs.append(__lib_path)
-    __libs.extend(__find_clang_libraries())
-    for __library_path in __libs:
+            yield __lib_path
+    # only searched if that one fails
+    yield from __find_clang_libraries()
+
+
+def __search_clang_cindex():
+    for __library_path in __candidate_clang_libraries():
         try:
             if os.path.isdir(__library_path):
                 cindex.Config.set_library_path(__library_path)
@@ -100,29 +220,51 @@ def __configure_clang_cindex():
     return None
 
 
-# check which clang python module is available
-# check which clang library is available
-try:
-    from clang import cindex
-    from ctypeslib.codegen.codegenerator import translate, translate_files
-
-    __clang_py_version__ = importlib.metadata.version('clang')
-    __clang_library_filename = __configure_clang_cindex()
+def _configure_clang():
+    """
+    Imports python-clang and configures it with the clang library, once.
+    The code generator calls it on import, so that importing ctypeslib alone does not.
+    """
+    global cindex, __clang_configured, __clang_library_filename, __clang_library_version
+    if __clang_configured:
+        return
+    # check which clang python module is available
+    try:
+        from clang import cindex
+    except ImportError:
+        warnings.warn("Could not find a version of python-clang installed. "
+                      "Please pip install clang==<version>.*", RuntimeWarning)
+        raise
+    __clang_configured = True
+    # check which clang library is available
+    __clang_library_filename, __clang_library_version = __configure_clang_cindex()
     if __clang_library_filename is None:
         warnings.warn("Could not find the clang library. please install llvm libclang", RuntimeWarning)
         # do not fail - maybe the user has a plan
     else:
         # set a warning if major versions differs.
-        if clang_version().split('.')[0] != clang_py_version().split('.')[0]:
-            clang_major = clang_version().split('.')[0]
+        if __clang_library_version.split('.')[0] != clang_py_version().split('.')[0]:
+            clang_major = __clang_library_version.split('.')[0]
             warnings.warn(f"Version of python-clang ({clang_py_version()}) and "
-                          f"clang C library ({clang_version()}) are different. "
+                          f"clang C library ({__clang_library_version}) are different. "
                           f"Did you try pip install clang=={clang_major}.*", RuntimeWarning)
-except ImportError as e:
-    __clang_py_version__ = None
-    warnings.warn("Could not find a version of python-clang installed. "
-                  "Please pip install clang==<version>.*", RuntimeWarning)
-    raise e
 
 
-__all__ = ['translate', 'translate_files', 'clang_version', 'clang_py_version']
+def __getattr__(name):
+    if name in __codegenerator_api:
+        from ctypeslib.codegen import codegenerator
+        value = getattr(codegenerator, name)
+    elif name == '__version__':
+        value = __package_version()
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | {'__version__'})
+
+
+__all__ = ['translate', 'translate_files', 'translate_to_code', 'translate_files_to_code', 'clang_version',
+           'clang_py_version']
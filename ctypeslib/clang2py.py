@@ -8,18 +8,30 @@ and providing tools for handling errors and exceptions that may occur when calli
 """
 
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import io
+import json
 import logging
+import multiprocessing
 import os
 import platform
+import socket
 import sys
-import tempfile
+import threading
+import time
 import traceback
 
 import ctypeslib
 from ctypeslib import clang_version, clang_py_version
+from ctypeslib import client
 from ctypeslib.codegen import config
-from ctypeslib.codegen.codegenerator import translate_files
+from ctypeslib.codegen import typedesc
+from ctypeslib.codegen import util
+from ctypeslib.codegen.codegenerator import CodeTranslator, compile_output, compiled_files, parse_files
 from ctypeslib.codegen.handler import InvalidTranslationUnitException
+from ctypeslib.codegen.symbolindex import SymbolIndex
 
 ################################################################
 windows_dll_names = """\
@@ -63,18 +75,21 @@ def _is_typedesc(item):
 
 
 class Input:
-    """A context manager to abstract input file, files or stdin"""
+    """
+    A context manager to abstract input file, files or stdin.
+    stdin is given to clang from memory, as the file stdin.c of the current directory.
+    """
+    stdin_filename = "stdin.c"
 
     def __init__(self, options):
         self.files = []
-        self._stdin = None
+        self.unsaved_files = {}
         for in_file in options.files:
             # stdin case
             if in_file == sys.stdin:
-                # pylint: disable-next=consider-using-with
-                _stdin = tempfile.NamedTemporaryFile(mode="w", prefix="stdin", suffix=".c", delete=False)
-                _stdin.write(in_file.read())
-                in_file = _stdin
+                self.files.append(self.stdin_filename)
+                self.unsaved_files[self.stdin_filename] = in_file.read()
+                continue
             self.files.append(in_file.name)
             in_file.close()
 
@@ -82,23 +97,36 @@ class Input:
         return self
 
     def __exit__(self, exc_type, exc_value, ecx_tb):
-        if self._stdin:
-            os.remove(self._stdin.name)
         return False
 
 
 class Output:
-    """A context manager to abstract out file or stdout"""
+    """
+    A context manager to abstract out file or stdout.
+    A file is written to a temporary file, that only replaces it if the content changed,
+    so that unchanged bindings are not touched.
+    """
 
     def __init__(self, options):
         # handle output
-        if options.output == "-":
+        self.filename = None
+        self.changed = False
+        if options.package:
+            # the output directory is written by CodeTranslator.generate_package
+            self.stream = None
+            self.output_file = None
+        elif options.output == "-":
             self.stream = sys.stdout
             self.output_file = None
-        else:
+        elif os.path.exists(options.output) and not os.path.isfile(options.output):
+            # /dev/null, a pipe...
             # pylint: disable-next=unspecified-encoding,consider-using-with
             self.stream = open(options.output, "w")
             self.output_file = self.stream
+        else:
+            self.filename = options.output
+            self.stream = util.temporary_file_for(options.output)
+            self.output_file = self.stream
 
     def __enter__(self):
         return self
@@ -106,13 +134,56 @@ class Output:
     def __exit__(self, exc_type, exc_value, ecx_tb):
         if self.output_file is not None:
             self.output_file.close()
-            # we do not want to delete the output file.
-            # os.remove(self.output_file.name)
+        if self.filename is not None:
+            if exc_type is None:
+                self.changed = util.replace_if_changed(self.output_file.name, self.filename)
+            else:
+                # leave the previous output as it was
+                os.remove(self.output_file.name)
         # If an exception is supplied, and the method wishes to suppress the exception
         # (i.e., prevent it from being propagated), it should return a true value.
         return False
 
 
+def _read_stamp(filename):
+    try:
+        with open(filename, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_up_to_date(stamp, argv):
+    """
+    Are the output files unchanged, and generated with the same arguments,
+    from input files and library files that did not change
+    """
+    if stamp is None or stamp.get("version") != ctypeslib.__version__ or stamp.get("argv") != list(argv):
+        return False
+    try:
+        hashes = list(stamp["outputs"].items()) + list(stamp["inputs"].items()) + list(stamp["libraries"].items())
+        return all(util.file_hash(name) == digest for name, digest in hashes)
+    except (OSError, KeyError):
+        return False
+
+
+def _write_stamp(filename, argv, input_files, outputs, libraries, unsaved_files=()):
+    """
+    Records the hashes of the input files, of the library files and of the output files.
+    The files in memory are never up to date. The libraries that are not files, but names
+    found by the dynamic loader, are only recorded in argv.
+    """
+    stamp = {
+        "version": ctypeslib.__version__,
+        "argv": list(argv),
+        "inputs": {name: None if os.path.abspath(name) in unsaved_files else util.file_hash(name)
+                   for name in input_files},
+        "libraries": {name: util.file_hash(name) for name in libraries if os.path.isfile(name)},
+        "outputs": {name: util.file_hash(name) for name in outputs},
+    }
+    util.write_if_changed(filename, json.dumps(stamp, indent=1) + "\n")
+
+
 def _make_parser(cfg):
     """Build the argparse parser"""
 
@@ -147,6 +218,13 @@ def _make_parser(cfg):
         help="include source file location in comments",
         default=False,
     )
+    parser.add_argument(
+        "--index",
+        dest="symbol_index",
+        metavar="INDEX",
+        help="write a SQLite index of all parsed declarations, see 'clang2py query --help'",
+        default=None,
+    )
     parser.add_argument(
         "-k",
         "--kind",
@@ -191,6 +269,39 @@ def _make_parser(cfg):
     else:
         default_modules = []  # ctypes is already imported
 
+    parser.add_argument(
+        "--lazy-functions",
+        dest="lazy_functions",
+        action="store_true",
+        help="bind and configure foreign functions on first access, instead of at import time",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--lazy-libraries",
+        dest="lazy_libraries",
+        action="store_true",
+        help="load shared libraries on first use, instead of at import time",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--record-tables",
+        dest="record_tables",
+        action="store_true",
+        help="declare structures and unions from compact tables, built in a loop at import time: "
+        "the .pyc is several times smaller, but the import is about 10%% slower",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--hoist-types",
+        dest="hoist_types",
+        action="store_true",
+        help="declare the pointer, array and function types written often enough once, and refer to them by name",
+        default=False,
+    )
+
     parser.add_argument(
         "-m",
         "--module",
@@ -203,6 +314,23 @@ def _make_parser(cfg):
 
     parser.add_argument("--nm", dest="nm", default="nm", help="nm program to use to extract symbols from libraries")
 
+    parser.add_argument(
+        "--symbol-cache",
+        dest="symbol_cache",
+        metavar="DIRECTORY",
+        default=None,
+        help="cache the symbols extracted from libraries in this directory, for the next runs",
+    )
+
+    parser.add_argument(
+        "--background-symbols",
+        dest="background_symbols",
+        action="store_true",
+        help="extract the symbols of the libraries in a process pool while the input is parsed, "
+        "when more than one CPU is available",
+        default=False,
+    )
+
     parser.add_argument(
         "-o",
         "--output",
@@ -212,6 +340,59 @@ def _make_parser(cfg):
     )
     # type=argparse.FileType('w'))
 
+    parser.add_argument(
+        "--package",
+        action="store_true",
+        help="write a package in the output directory, with one lazily imported submodule per source file",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--stamp",
+        metavar="STAMP_FILE",
+        help="record the hashes of the input files in STAMP_FILE, and do nothing if they did not change",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--pyc",
+        action="store_true",
+        help="also write the compiled bytecode of the output in __pycache__, validated by source hash",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--pyc-optimize",
+        dest="pyc_optimize",
+        type=int,
+        choices=[-1, 0, 1, 2],
+        help="optimization level of the compiled bytecode, as python -O. Default is the level of this interpreter",
+        default=-1,
+    )
+
+    parser.add_argument(
+        "--sourceless",
+        action="store_true",
+        help="write the compiled bytecode next to the output, to be shipped without the python source",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running, and update the output each time an input file, or a file it includes, changes",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--watch-interval",
+        dest="watch_interval",
+        metavar="SECONDS",
+        type=float,
+        help="how often --watch checks the files for changes. Default is 0.5",
+        default=0.5,
+    )
+
     parser.add_argument(
         "-p",
         "--preload",
@@ -222,6 +403,14 @@ def _make_parser(cfg):
         default=[],
     )
 
+    parser.add_argument(
+        "--prune-unreachable",
+        dest="prune_unreachable",
+        action="store_true",
+        help="only include types reachable from exported functions, variables and requested symbols",
+        default=False,
+    )
+
     parser.add_argument(
         "-q", "--quiet", action="store_const", const="quiet", help="Shut down warnings and below", default=False
     )
@@ -308,10 +497,73 @@ def _make_parser(cfg):
     return parser
 
 
+def _make_query_parser():
+    """Build the argparse parser for the query subcommand"""
+    parser = argparse.ArgumentParser(
+        prog="clang2py query", description="Look up declarations in an index written by clang2py --index"
+    )
+    parser.add_argument("index", metavar="INDEX", help="SQLite index filename")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-n", "--name", help="declarations with this name (struct, function, macro, ...)")
+    group.add_argument("--field", help="records that define a field with this name")
+    group.add_argument("--takes", metavar="TYPE", help="functions that take an argument of this type")
+    group.add_argument("--uses", metavar="TYPE", help="declarations that depend on this type")
+    parser.add_argument("-k", "--kind", help="only declarations of this kind (Structure, Function, Macro, ...)")
+    parser.add_argument("--members", action="store_true", default=False,
+                        help="also print the fields or arguments of the declarations found")
+    return parser
+
+
+def query(argv):
+    """entry point for clang2py query"""
+    options = _make_query_parser().parse_args(argv)
+    if not os.path.exists(options.index):
+        print(f"clang2py query: index {options.index} does not exist", file=sys.stderr)
+        return 2
+    with SymbolIndex(options.index) as index:
+        if options.name is not None:
+            rows = index.lookup(options.name, options.kind)
+        elif options.field is not None:
+            rows = index.with_field(options.field)
+        elif options.takes is not None:
+            rows = index.taking(options.takes)
+        else:
+            rows = index.users(options.uses)
+        if options.kind is not None:
+            rows = [row for row in rows if row[1] == options.kind]
+        for name, kind, filename, line, size, align, _type in rows:
+            desc = f"{kind} {name}"
+            if _type is not None:
+                desc += f" : {_type}"
+            if size is not None:
+                desc += f" size:{size} align:{align}"
+            print(f"{filename}:{line}: {desc}")
+            if options.members:
+                members = index.fields(name) if kind in ("Structure", "Union") else index.arguments(name)
+                for member in members:
+                    print("    " + " ".join(str(_) for _ in member))
+    return 0 if rows else 1
+
+
 def main(argv=None):
     """entry point for clang2py"""
     if argv is None:
         argv = sys.argv[1:]
+    if argv and argv[0] == "query":
+        return query(argv[1:])
+    if any(arg == "--manifest" or arg.startswith("--manifest=") for arg in argv):
+        return batch(argv)
+    if any(arg == "--serve" or arg.startswith("--serve=") for arg in argv):
+        return serve(argv)
+    return _run(argv)
+
+
+def _run(argv, session=None, timings=None):
+    """
+    Runs clang2py with the command line arguments argv.
+    session: the BatchSession of a manifest, to share with its other jobs
+    timings: a dict to record the parse and generate times in, in seconds
+    """
     cfg = config.CodegenConfig()
     cfg.local_platform_triple = f"{platform.machine()}-{platform.system()}"
     cfg.known_symbols = {}
@@ -327,25 +579,501 @@ def main(argv=None):
     elif options.quiet:
         level = logging.ERROR
     logging.basicConfig(level=level, stream=sys.stderr)
+    # basicConfig does nothing once the root logger has a handler, as for the next jobs of a manifest
+    root = logging.getLogger()
+    previous = root.level
+    root.setLevel(level)
+    try:
+        return _run_options(parser, options, argv, cfg, session, timings)
+    finally:
+        root.setLevel(previous)
+
+
+def _run_options(parser, options, argv, cfg, session, timings):
+    """Runs clang2py with the parsed options, see _run"""
+    if options.package and options.output == "-":
+        parser.error("--package requires an output directory (-o)")
+    if (options.pyc or options.sourceless or options.stamp) and options.output == "-":
+        parser.error("--pyc, --sourceless and --stamp require an output file (-o)")
+
+    if options.watch and (options.output == "-" or sys.stdin in options.files):
+        parser.error("--watch requires input files and an output (-o)")
+    if options.watch and session is not None:
+        parser.error("--watch can not be used in a manifest, nor with a clang2py daemon")
+
+    if options.stamp and os.path.exists(options.output):
+        if _is_up_to_date(_read_stamp(options.stamp), argv):
+            logging.info("%s is up to date", options.output)
+            return 0
 
     # capture codegen options in config
     cfg.parse_options(options)
 
     # handle input files, and outputs
     try:
-        with Input(options) as inputs, Output(options) as outputs:
+        with Input(options) as inputs:
+            start = time.perf_counter()
+            if session is None:
+                translator = parse_files(inputs.files, cfg, unsaved_files=inputs.unsaved_files)
+            else:
+                translator = session.parse_files(inputs.files, cfg, inputs.unsaved_files)
+            parsed = time.perf_counter()
+            _generate(translator, options, argv)
+    except InvalidTranslationUnitException:
+        return 1
+    if timings is not None:
+        timings["parse"] = parsed - start
+        timings["generate"] = time.perf_counter() - parsed
+    if options.watch:
+        return _watch(translator, options, argv)
+    return 0
+
+
+def _generate(translator, options, argv):
+    """Writes the output of a parsed translator, and returns True if the output file changed"""
+    with Output(options) as outputs:
+        if options.package:
+            modules = translator.generate_package(options.output)
+            written = [os.path.join(options.output, name + ".py") for name in ["__init__"] + modules]
+        else:
+            written = [options.output]
             # start codegen
-            if cfg.generate_comments:
+            if translator.cfg.generate_comments:
                 outputs.stream.write("# generated by 'clang2py'\n")
                 outputs.stream.write(f"# flags '{' '.join(argv[1:])}'\n")
 
             # Preload libraries
             # [Library(name, mode=RTLD_GLOBAL) for name in options.preload]
 
-            translate_files(inputs.files, outputs.stream, cfg)
-    except InvalidTranslationUnitException:
-        return 1
-    return 0
+            translator.generator = None
+            translator.generate_code(outputs.stream)
+    if options.pyc or options.sourceless:
+        compile_output(options.output, options.pyc_optimize, options.sourceless)
+        written += compiled_files(written, options.pyc_optimize, options.sourceless)
+    if options.stamp:
+        _write_stamp(options.stamp, argv, translator.input_files, written, options.dll,
+                     translator.parser.unsaved_files)
+    return outputs.changed
+
+
+def _modification_times(filenames):
+    mtimes = {}
+    for name in filenames:
+        try:
+            mtimes[name] = os.stat(name).st_mtime_ns
+        except OSError:
+            mtimes[name] = None
+    return mtimes
+
+
+def _file_hashes(filenames):
+    hashes = {}
+    for name in filenames:
+        try:
+            hashes[name] = util.file_hash(name)
+        except OSError:
+            hashes[name] = None
+    return hashes
+
+
+def _watch(translator, options, argv):
+    """
+    Updates the output each time the input files, or the files they include, change, until interrupted.
+    The translation units are reparsed, and only the declarations of the changed files, and the ones
+    depending on them, are converted again.
+    """
+    mtimes = _modification_times(translator.input_files)
+    hashes = _file_hashes(translator.input_files)
+    logging.info("watching %d files for changes", len(mtimes))
+    changed = set()
+    try:
+        while True:
+            time.sleep(options.watch_interval)
+            current = _modification_times(translator.input_files)
+            touched = _file_hashes(name for name, mtime in current.items() if mtimes.get(name) != mtime)
+            mtimes = current
+            # a file saved, or checked out, again is not changed
+            changed.update(name for name, digest in touched.items() if hashes.get(name) != digest)
+            hashes.update(touched)
+            if not changed:
+                continue
+            start = time.perf_counter()
+            try:
+                translator.reparse(changed)
+            except InvalidTranslationUnitException:
+                # wait for the next change, the output is left as it was
+                logging.error("not updating %s: %s has errors", options.output, " ".join(sorted(changed)))
+                continue
+            changed.clear()
+            updated = _generate(translator, options, argv)
+            # the files that are now included
+            new_files = set(translator.input_files) - set(mtimes)
+            mtimes.update(_modification_times(new_files))
+            hashes.update(_file_hashes(new_files))
+            logging.info("%s %s in %.3fs", options.output, "updated" if updated else "unchanged",
+                         time.perf_counter() - start)
+    except KeyboardInterrupt:
+        return 0
+
+
+class BatchSession:
+    """
+    The state shared by the jobs of a manifest that run in the same process:
+    the clang Index, and the last translation units parsed.
+    The target type tables are cached by Clang_Parser itself, and owned by each parser,
+    the library symbols are shared by the process, see library.shared_library().
+    """
+    # number of parsed inputs kept for the next jobs
+    max_parsed = 4
+
+    def __init__(self):
+        from clang.cindex import Index
+        self.index = Index.create()
+        self.parsed = collections.OrderedDict()
+
+    @staticmethod
+    def _parse_key(files, cfg):
+        # the configuration used by the parser, the rest only matters to the code generation
+        return (tuple(files), tuple(cfg.clang_opts), typedesc.Macro in cfg.types, cfg.generate_comments,
+                cfg.filter_location)
+
+    @staticmethod
+    def _mtimes(filenames):
+        try:
+            return [os.stat(name).st_mtime_ns for name in filenames]
+        except OSError:
+            return None
+
+    def parse_files(self, files, cfg, unsaved_files=None):
+        """Returns a CodeTranslator for files, reusing the parse of a previous job if the input is unchanged"""
+        if unsaved_files:
+            # stdin, there is no modification time to validate a parse with
+            return parse_files(files, cfg, index=self.index, unsaved_files=unsaved_files)
+        key = self._parse_key(files, cfg)
+        entry = self.parsed.pop(key, None)
+        if entry is None or self._mtimes(entry[0].input_files) != entry[1]:
+            translator = parse_files(files, cfg, index=self.index)
+            entry = translator, self._mtimes(translator.input_files)
+        else:
+            parsed = entry[0]
+            translator = CodeTranslator(cfg)
+            translator.preload_dlls()
+            translator.parser = parsed.parser
+            translator.items = list(parsed.items)
+            translator.input_files = parsed.input_files.copy()
+            if cfg.symbol_index:
+                translator.write_symbol_index(cfg.symbol_index)
+        self.parsed[key] = entry
+        while len(self.parsed) > self.max_parsed:
+            self.parsed.popitem(last=False)
+        return translator
+
+
+def _load_manifest(filename):
+    """
+    Returns the jobs of a manifest file, as a list of (name, argv).
+    The manifest is a TOML or JSON document with a list of jobs. Each job has clang2py arguments
+    in "args", and optionally "inputs", "output" and a "name". The top level "args" are given
+    to every job, first.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    if filename.endswith(".toml"):
+        try:
+            import tomllib  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            try:
+                import tomli as tomllib  # pylint: disable=import-outside-toplevel
+            except ImportError as e:
+                raise ValueError("TOML manifests require python 3.11 or the tomli package") from e
+        manifest = tomllib.loads(data.decode("utf-8"))
+    else:
+        manifest = json.loads(data)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("jobs"), list):
+        raise ValueError("the manifest has no list of jobs")
+    common = manifest.get("args", [])
+    jobs = []
+    for i, job in enumerate(manifest["jobs"]):
+        if not isinstance(job, dict):
+            raise ValueError(f"job {i} is not a table")
+        argv = list(common) + list(job.get("args", []))
+        if "output" in job:
+            argv.extend(["-o", job["output"]])
+        argv.extend(job.get("inputs", []))
+        if not all(isinstance(arg, str) for arg in argv):
+            raise ValueError(f"job {i} arguments are not all strings")
+        jobs.append((str(job.get("name", i)), argv))
+    return jobs
+
+
+# the BatchSession of this process, for the jobs of a manifest
+_session = None
+
+
+def _run_job(argv):
+    """Runs a job of a manifest in this process, and returns its exit code and timings"""
+    global _session  # pylint: disable=global-statement
+    if _session is None:
+        _session = BatchSession()
+    timings = {}
+    start = time.perf_counter()
+    try:
+        code = _run(argv, _session, timings)
+    except SystemExit as e:
+        # argparse errors, --help and --version
+        code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logging.exception("clang2py %s", " ".join(argv))
+        code = 1
+    timings["total"] = time.perf_counter() - start
+    return code, timings
+
+
+def _print_report(jobs, results, elapsed, stream):
+    width = max([len("job")] + [len(name) for name, _ in jobs])
+    print(f"{'job':<{width}}  {'status':<6}  {'parse':>8}  {'generate':>8}  {'total':>8}", file=stream)
+    for (name, _), (code, timings) in zip(jobs, results):
+        status = "ok" if code == 0 else f"exit {code}"
+        times = [f"{timings[_]:8.3f}" if _ in timings else f"{'-':>8}" for _ in ("parse", "generate", "total")]
+        print(f"{name:<{width}}  {status:<6}  {'  '.join(times)}", file=stream)
+    failed = sum(1 for code, _ in results if code != 0)
+    print(f"{len(results)} jobs, {failed} failed, {elapsed:.3f}s", file=stream)
+
+
+def _make_batch_parser():
+    """Build the argparse parser for the manifest mode"""
+    parser = argparse.ArgumentParser(
+        prog="clang2py --manifest", description="Run the clang2py jobs of a manifest in one process"
+    )
+    parser.add_argument("--manifest", required=True, metavar="MANIFEST",
+                        help="TOML or JSON file listing the jobs, each with its clang2py arguments")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes running jobs in parallel")
+    parser.add_argument("--debug", action="store_const", const=True, help="setLevel to DEBUG")
+    parser.add_argument("-q", "--quiet", action="store_const", const=True,
+                        help="quiet mode, no timing report and only errors")
+    return parser
+
+
+def batch(argv):
+    """entry point for clang2py --manifest"""
+    options = _make_batch_parser().parse_args(argv)
+    level = logging.INFO
+    if options.debug:
+        level = logging.DEBUG
+    elif options.quiet:
+        level = logging.ERROR
+    logging.basicConfig(level=level, stream=sys.stderr)
+    try:
+        jobs = _load_manifest(options.manifest)
+    except (OSError, ValueError) as e:
+        print(f"clang2py: invalid manifest {options.manifest}: {e}", file=sys.stderr)
+        return 2
+    start = time.perf_counter()
+    if options.jobs > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(options.jobs, len(jobs))) as executor:
+            results = list(executor.map(_run_job, [argv for _, argv in jobs]))
+    else:
+        results = [_run_job(argv) for _, argv in jobs]
+    if not options.quiet:
+        _print_report(jobs, results, time.perf_counter() - start, sys.stderr)
+    return 0 if all(code == 0 for code, _ in results) else 1
+
+
+def _serve_job(request):
+    """Runs the request of a client in a worker process, in its directory and with its standard streams"""
+    os.chdir(request["cwd"])
+    stdout, stderr = io.StringIO(), io.StringIO()
+    root = logging.getLogger()
+    stdin = sys.stdin
+    sys.stdin = io.StringIO(request.get("stdin", ""))
+    try:
+        # the logging of the job, configured by its options, goes to its stderr
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            code, timings = _run_job(request["argv"])
+    finally:
+        sys.stdin = stdin
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+    return {"exit": code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "timings": timings}
+
+
+class Server:
+    """
+    A daemon running clang2py requests received on a Unix socket, in worker processes that keep
+    libclang loaded and their BatchSession warm. See ctypeslib.client for the protocol.
+
+    At most max_requests requests are accepted at once, running or waiting for a worker,
+    the others are refused. The daemon exits after idle_timeout seconds without requests.
+    """
+    # the request latencies kept for the metrics
+    max_latencies = 1000
+
+    def __init__(self, path, workers, max_requests, idle_timeout):
+        self.path = path
+        self.workers = workers
+        self.max_requests = max_requests
+        self.idle_timeout = idle_timeout
+        self.executor = None
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_request = time.monotonic()
+        self.started = time.monotonic()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=self.max_latencies)
+
+    def stats(self):
+        """Returns the metrics of the daemon"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {"uptime": time.monotonic() - self.started, "workers": self.workers, "active": self.active,
+                     "requests": dict(self.counts)}
+        if latencies:
+            stats["latency"] = {"mean": sum(latencies) / len(latencies),
+                                "p50": latencies[len(latencies) // 2],
+                                "p95": latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)],
+                                "max": latencies[-1]}
+        return stats
+
+    def _reply(self, request):
+        if request.get("command") == "stats":
+            return self.stats()
+        if not isinstance(request.get("argv"), list) or not isinstance(request.get("cwd"), str):
+            with self.lock:
+                self.counts["invalid"] += 1
+            return {"error": "invalid request"}
+        with self.lock:
+            if self.active >= self.max_requests:
+                self.counts["refused"] += 1
+                return {"error": "busy"}
+            self.active += 1
+        start = time.perf_counter()
+        executor = self.executor
+        try:
+            reply = executor.submit(_serve_job, request).result()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.exception("request failed")
+            reply = {"exit": 1, "stdout": "", "stderr": "clang2py: %s\n" % (e or type(e).__name__)}
+            if isinstance(e, concurrent.futures.BrokenExecutor):
+                # a worker died, the pool runs no more jobs
+                self._restart_executor(executor)
+        latency = time.perf_counter() - start
+        with self.lock:
+            self.active -= 1
+            self.last_request = time.monotonic()
+            self.latencies.append(latency)
+            self.counts["ok" if reply["exit"] == 0 else "failed"] += 1
+        logging.info("%s: exit %d in %.3fs", " ".join(request["argv"]), reply["exit"], latency)
+        return reply
+
+    def _start_executor(self):
+        # the workers start from a clean interpreter, this process has threads
+        context = multiprocessing.get_context("spawn")
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+
+    def _restart_executor(self, broken):
+        """Replaces the broken pool, once for all the requests that failed in it"""
+        with self.lock:
+            if self.executor is not broken:
+                return
+            logging.error("a worker process died, restarting the workers")
+            self._start_executor()
+        broken.shutdown(wait=False)
+
+    def _handle(self, connection):
+        with connection:
+            try:
+                with connection.makefile("rb") as stream:
+                    request = json.loads(stream.readline())
+                reply = self._reply(request)
+            except ValueError:
+                reply = {"error": "invalid request"}
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.exception("request failed")
+                reply = {"error": str(e)}
+            try:
+                connection.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+            except OSError:
+                # the client is gone
+                pass
+
+    def _idle(self):
+        with self.lock:
+            return (self.idle_timeout and self.active == 0
+                    and time.monotonic() - self.last_request > self.idle_timeout)
+
+    def run(self):
+        """Serves requests until the daemon is idle for idle_timeout seconds"""
+        self._start_executor()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if os.path.exists(self.path):
+                try:
+                    client.request(self.path, {"command": "stats"})
+                except (OSError, ValueError):
+                    # left by a daemon that did not exit cleanly
+                    os.remove(self.path)
+                else:
+                    logging.error("a daemon is already serving on %s", self.path)
+                    return 1
+            # only this user can send requests
+            umask = os.umask(0o177)
+            try:
+                listener.bind(self.path)
+            finally:
+                os.umask(umask)
+            listener.listen()
+            listener.settimeout(1)
+            logging.info("clang2py serving on %s with %d workers", self.path, self.workers)
+            while not self._idle():
+                try:
+                    connection, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                connection.settimeout(None)
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+            logging.info("clang2py idle for %ss, exiting: %s", self.idle_timeout, json.dumps(self.stats()))
+        finally:
+            listener.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.executor.shutdown(wait=True)
+        return 0
+
+
+def _make_serve_parser():
+    """Build the argparse parser for the daemon mode"""
+    parser = argparse.ArgumentParser(
+        prog="clang2py --serve",
+        description="Serve clang2py requests from clang2py-client on a Unix socket, with libclang and caches warm",
+    )
+    parser.add_argument("--serve", nargs="?", const=client.default_socket(), required=True, metavar="SOCKET",
+                        help=f"Unix socket to listen on (default: {client.default_socket()})")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes running requests in parallel")
+    parser.add_argument("--max-requests", type=int, default=None,
+                        help="requests accepted at once, running or waiting, the others are refused "
+                             "(default: 4 per worker)")
+    parser.add_argument("--idle-timeout", type=float, default=600,
+                        help="exit after this many seconds without requests, 0 to never exit (default: 600)")
+    parser.add_argument("--debug", action="store_const", const=True, help="setLevel to DEBUG")
+    parser.add_argument("-q", "--quiet", action="store_const", const=True, help="quiet mode, only errors")
+    return parser
+
+
+def serve(argv):
+    """entry point for clang2py --serve"""
+    options = _make_serve_parser().parse_args(argv)
+    level = logging.INFO
+    if options.debug:
+        level = logging.DEBUG
+    elif options.quiet:
+        level = logging.ERROR
+    logging.basicConfig(level=level, stream=sys.stderr)
+    max_requests = options.max_requests or 4 * options.jobs
+    return Server(options.serve, options.jobs, max_requests, options.idle_timeout).run()
 
 
 if __name__ == "__main__":
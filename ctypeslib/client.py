@@ -0,0 +1,92 @@
+"""
+clang2py-client - a drop-in replacement for clang2py, that sends the translation to a `clang2py --serve` daemon.
+
+The daemon listens on the Unix socket named by CLANG2PY_SOCKET, or on default_socket().
+When no daemon answers within --client-timeout SECONDS (default 600), or it is busy,
+clang2py runs in this process instead.
+
+The protocol is one JSON request per connection, terminated by a new line, answered by one JSON reply:
+    {"argv": [...], "cwd": "...", "stdin": "..."} -> {"exit": 0, "stdout": "...", "stderr": "...", "timings": {...}}
+    {"command": "stats"} -> the daemon metrics
+A daemon that cannot take the request replies {"error": "..."}.
+"""
+
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# seconds to wait for the daemon to accept, read or answer a request
+DEFAULT_TIMEOUT = 600.0
+
+
+def default_socket():
+    """The socket of the daemon of this user"""
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, f"clang2py-{os.getuid()}.sock")
+
+
+def request(path, message, timeout=DEFAULT_TIMEOUT):
+    """
+    Sends a request to the daemon listening on path, and returns its reply. Raises OSError or ValueError,
+    and socket.timeout, an OSError, if the daemon does not answer in time.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+def _pop_timeout(argv):
+    """Removes the --client-timeout option from argv, that is not a clang2py option, and returns its value"""
+    timeout = DEFAULT_TIMEOUT
+    for i, arg in enumerate(argv):
+        if arg == "--client-timeout" and i + 1 < len(argv):
+            timeout = float(argv[i + 1])
+            del argv[i:i + 2]
+            break
+        if arg.startswith("--client-timeout="):
+            timeout = float(arg.split("=", 1)[1])
+            del argv[i]
+            break
+    return timeout
+
+
+def main(argv=None):
+    """entry point for clang2py-client"""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    timeout = _pop_timeout(argv)
+    path = os.environ.get("CLANG2PY_SOCKET") or default_socket()
+    if argv == ["--server-stats"]:
+        print(json.dumps(request(path, {"command": "stats"}, timeout), indent=1))
+        return 0
+    message = {"argv": argv, "cwd": os.getcwd()}
+    if "-" in argv and not sys.stdin.isatty():
+        message["stdin"] = sys.stdin.read()
+    try:
+        reply = request(path, message, timeout)
+    except (OSError, ValueError):
+        reply = None
+    if reply is None or "error" in reply:
+        # no daemon, or a busy one
+        from ctypeslib import clang2py  # pylint: disable=import-outside-toplevel
+        if "stdin" in message:
+            sys.stdin = io.StringIO(message["stdin"])
+        return clang2py.main(argv)
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["exit"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
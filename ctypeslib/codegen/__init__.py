@@ -1 +1,5 @@
 # the ctypeslib.codegen package
+import ctypeslib
+
+# the code generator needs python-clang configured with the clang library
+ctypeslib._configure_clang()
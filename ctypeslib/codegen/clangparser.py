@@ -2,9 +2,11 @@
 
 import logging
 import os
+import re
 import collections
+import types
 
-from clang.cindex import Index, TranslationUnit
+from clang.cindex import CursorKind, Index, TranslationUnit
 from clang.cindex import TypeKind
 
 from ctypeslib.codegen import cursorhandler
@@ -17,6 +19,13 @@ from ctypeslib.codegen.handler import InvalidTranslationUnitException
 
 log = logging.getLogger("clangparser")
 
+# a record named in C source, as in "struct name" or "union name"
+_RECORD_NAMES = re.compile(rb"\b(struct|union|class)\s+([A-Za-z_]\w*)")
+
+# the ctypes type names and sizes in bits of the fundamental types for a clang target,
+# read-only mappings shared by all the parsers of that target
+TargetTypes = collections.namedtuple("TargetTypes", ["typenames", "sizes"])
+
 
 class Clang_Parser:
     """
@@ -25,6 +34,10 @@ class Clang_Parser:
 
     For each Declaration a declaration will be saved, and the type of that
     declaration will be cached and saved.
+
+    A parser is not thread safe, but parsers in different threads are independent,
+    and can parse for different targets concurrently. The only state they share are
+    the immutable target type tables.
     """
 
     has_values = {
@@ -40,7 +53,8 @@ class Clang_Parser:
     }
 
     # FIXME, macro definition __SIZEOF_DOUBLE__
-    ctypes_typename = {
+    # the type names of all targets, make_ctypes_convertor() sets those of the parser target
+    ctypes_typename = types.MappingProxyType({
         TypeKind.VOID: "None",  # because ctypes.POINTER(None) == c_void_p
         TypeKind.BOOL: "c_bool",
         TypeKind.CHAR_U: "c_ubyte",  # ?? used for PADDING
@@ -65,19 +79,46 @@ class Clang_Parser:
         TypeKind.LONGDOUBLE: "c_longdouble",
         TypeKind.POINTER: "POINTER_T",
         TypeKind.NULLPTR: "c_void_p",
-    }
+    })
+
+    # the TargetTypes computed by make_ctypes_convertor, by clang flags
+    _target_tables = {}
 
-    def __init__(self, flags):
+    def __init__(self, flags, index=None):
         self.all = collections.OrderedDict()
         # a shortcut to identify registered decl in cases of records
         self.all_set = set()
+        # clang USR of declarations, and the python name they were registered with
+        self.all_usr = {}
+        self._usr_names = {}
+        # names in registration order, and the position reached by get_result()
+        self._registered_names = []
+        self._result_index = 0
+        self._namespace = {}
         self.cpp_data = {}
+        # the number of cpp_data lines already handled, by kind, and the aliases found in them
+        self._cpp_data_index = {}
+        self._aliases = {}
         self._unhandled = []
         self.fields = {}
         self.tu = None
         self.tu_options = None
+        # the translation units by input file, and the files they include, kept for reparse() if incremental
+        self.incremental = False
+        self.translation_units = collections.OrderedDict()
+        self._includes = {}
+        # the referrers of the type descriptions, those located in each file, the records declared apart
+        # from their definition by name, and the record names found in each file, for reparse()
+        self._indexed = set()
+        self._referrers = collections.defaultdict(list)
+        self._by_file = collections.defaultdict(set)
+        self._declared_records = collections.defaultdict(set)
+        self._record_names = {}
+        # the contents of the files held in memory, by absolute filename, given to clang instead of files on disk
+        self.unsaved_files = collections.OrderedDict()
         self.flags = flags
-        self.ctypes_sizes = {}
+        # the clang Index to parse files with, a new one for each file if None
+        self.index = index
         self.init_parsing_options()
         self.make_ctypes_convertor(flags)
         self.cursorkind_handler = cursorhandler.CursorHandler(self)
@@ -98,13 +139,32 @@ class Clang_Parser:
         """Activates the comment parsing options in the Translation Unit."""
         self.tu_options |= TranslationUnit.PARSE_INCLUDE_BRIEF_COMMENTS_IN_CODE_COMPLETION
 
+    def activate_incremental_parsing(self):
+        """Keeps the Translation Units, to reparse them on changes."""
+        self.incremental = True
+
     def deactivate_function_body_parsing(self):
         self.tu_options |= TranslationUnit.PARSE_SKIP_FUNCTION_BODIES
 
     def filter_location(self, src_files):
         self.__filter_location = [os.path.abspath(f) for f in src_files]
 
-    def parse(self, filename):
+    def add_unsaved_files(self, unsaved_files):
+        """
+        Holds files in memory, a mapping or (filename, contents) pairs, as in libclang.
+        Clang reads them instead of the files on disk, that need not exist, and they include each other by name.
+        """
+        if isinstance(unsaved_files, dict):
+            unsaved_files = unsaved_files.items()
+        for filename, contents in unsaved_files:
+            if hasattr(contents, "read"):
+                contents = contents.read()
+            self.unsaved_files[os.path.abspath(filename)] = contents
+
+    def _unsaved_files(self):
+        return list(self.unsaved_files.items())
+
+    def parse(self, filename, unsaved_files=None):
         """
         . reads 1 file
         . if there is a compilation error, print a warning
@@ -115,24 +175,173 @@ class Clang_Parser:
             - underlying type is cursor.type.get_declaration() for Record
         . for each VAR_DECL, register a Variable
         . for each TYPEREF ??
+        unsaved_files: files held in memory, see add_unsaved_files()
         """
         if os.path.abspath(filename) in self.__processed_location:
             return
-        index = Index.create()
-        translation_unit = index.parse(filename, self.flags, options=self.tu_options)
+        if unsaved_files:
+            self.add_unsaved_files(unsaved_files)
+        if os.path.abspath(filename) in self.unsaved_files:
+            # clang finds the files in memory by their absolute name
+            filename = os.path.abspath(filename)
+        index = self.index if self.index is not None else Index.create()
+        translation_unit = index.parse(filename, self.flags, unsaved_files=self._unsaved_files(),
+                                       options=self.tu_options)
         if not translation_unit:
             log.warning("unable to load input")
             return
         self._parse_tu_diagnostics(translation_unit, filename)
         self.tu = translation_unit
+        if self.incremental:
+            self.translation_units[os.path.abspath(filename)] = translation_unit
+            self._includes[os.path.abspath(filename)] = self._included_files(translation_unit)
+            for included in self._includes[os.path.abspath(filename)] | {os.path.abspath(filename)}:
+                if included not in self._record_names:
+                    self._record_names[included] = self._read_record_names(included)
         root = self.tu.cursor
         for node in root.get_children():
             self.start_element(node)
         return
 
-    def parse_string(self, input_data, lang="c", all_warnings=False, flags=None):
-        """Use this parser on a memory string/file, instead of a file on disk"""
-        translation_unit = util.get_tu(input_data, lang, all_warnings, flags)
+    def reparse(self, filenames):
+        """
+        Reparses the translation units that include one of the changed files, and converts again the
+        declarations of these files, and the declarations depending on them.
+        Returns the removed type descriptions, get_result() returns the new ones.
+        Nothing is changed if a translation unit has errors.
+        """
+        changed = {os.path.abspath(f) for f in filenames}
+        includes = dict(self._includes)
+        for filename, translation_unit in self.translation_units.items():
+            if filename in changed or includes[filename] & changed:
+                translation_unit.reparse(unsaved_files=self._unsaved_files())
+                self._parse_tu_diagnostics(translation_unit, filename)
+                included = self._included_files(translation_unit)
+                # the declarations of files newly included, or not anymore, changed too
+                changed |= included ^ includes[filename]
+                includes[filename] = included
+        # records declared apart from their definition are found by the names in the files
+        records = set()
+        for filename in changed:
+            records |= self._record_names.pop(filename, set())
+            self._record_names[filename] = self._read_record_names(filename)
+            records |= self._record_names[filename]
+        self._includes = includes
+        removed, records = self._dependents(changed, records)
+        # the declarations of unchanged files are found again at their location
+        revisit = collections.defaultdict(set)
+        for name, obj in removed.items():
+            self.remove_registered(name)
+            self._namespace.pop(name, None)
+            location = getattr(obj, "location", None)
+            if location:
+                revisit[os.path.abspath(location[0])].add(location[1])
+        spellings = {name.split("_", 1)[-1] for name in records}
+        paths = {}
+        for filename, translation_unit in self.translation_units.items():
+            if filename not in changed and not includes[filename] & changed:
+                continue
+            self.tu = translation_unit
+            for node in translation_unit.cursor.get_children():
+                location = node.location
+                if location.file is None:
+                    continue
+                filepath = paths.get(location.file.name)
+                if filepath is None:
+                    filepath = paths[location.file.name] = os.path.abspath(location.file.name)
+                if filepath in changed or (filepath in revisit and location.line in revisit[filepath]):
+                    self.start_element(node)
+                elif (node.kind in self._record_kinds and node.spelling in spellings
+                      and self.cursorkind_handler.get_unique_name(node) in records):
+                    # the declarations and definition of a record declared apart from its definition
+                    self.start_element(node)
+        return list(removed.values())
+
+    _record_kinds = (CursorKind.STRUCT_DECL, CursorKind.UNION_DECL, CursorKind.CLASS_DECL)
+
+    @staticmethod
+    def _included_files(translation_unit):
+        return {os.path.abspath(i.include.name) for i in translation_unit.get_includes()}
+
+    def _read_record_names(self, filename):
+        """Returns the type names of the records named in a file"""
+        if filename in self.unsaved_files:
+            text = self.unsaved_files[filename]
+            if isinstance(text, str):
+                text = text.encode()
+        else:
+            try:
+                with open(filename, "rb") as f:
+                    text = f.read()
+            except OSError:
+                return set()
+        return {f"{kind.decode()}_{name.decode()}" for kind, name in _RECORD_NAMES.findall(text)}
+
+    @staticmethod
+    def _is_declared_record(obj):
+        """A record declared before its definition has no location, one without definition has no members"""
+        return typedesc.is_record(obj) and (obj.location is None or obj.members is None)
+
+    def _index_dependencies(self):
+        """Records the referrers of the type descriptions registered since the last call, for reparse()"""
+        todo = [obj for obj in self.all.values() if obj not in self._indexed]
+        paths = {}
+        while todo:
+            obj = todo.pop()
+            if obj in self._indexed:
+                continue
+            self._indexed.add(obj)
+            location = getattr(obj, "location", None)
+            if location:
+                filepath = paths.get(location[0])
+                if filepath is None:
+                    filepath = paths[location[0]] = os.path.abspath(location[0])
+                self._by_file[filepath].add(obj)
+            if self._is_declared_record(obj):
+                self._declared_records[obj.name].add(obj)
+            for dep in typedesc.dependencies(obj):
+                self._referrers[dep].append(obj)
+                todo.append(dep)
+
+    def _dependents(self, changed, records):
+        """
+        Returns the registered type descriptions, by name, that are defined in the changed files, or
+        depend on one, or on a record declared apart from its definition named in records.
+        Also returns the names of the records declared apart from their definition they depend on.
+        """
+        stale = []
+        for filename in changed:
+            stale.extend(self._by_file.pop(filename, ()))
+        for name in records:
+            stale.extend(self._declared_records.pop(name, ()))
+        dependents = set()
+        while stale:
+            obj = stale.pop()
+            if obj in dependents:
+                continue
+            dependents.add(obj)
+            stale.extend(self._referrers.pop(obj, ()))
+        # they are replaced by new ones
+        self._indexed -= dependents
+        records = set()
+        for obj in dependents:
+            location = getattr(obj, "location", None)
+            if location:
+                self._by_file[os.path.abspath(location[0])].discard(obj)
+            if self._is_declared_record(obj):
+                self._declared_records[obj.name].discard(obj)
+                records.add(obj.name)
+        removed = collections.OrderedDict((name, obj) for name, obj in self.all.items() if obj in dependents)
+        return removed, records
+
+    def parse_string(self, input_data, lang="c", all_warnings=False, flags=None, unsaved_files=None):
+        """
+        Use this parser on a memory string/file, instead of a file on disk.
+        unsaved_files: other files held in memory, that the string can include, see add_unsaved_files()
+        """
+        if unsaved_files:
+            self.add_unsaved_files(unsaved_files)
+        translation_unit = util.get_tu(input_data, lang, all_warnings, flags, self._unsaved_files())
         self._parse_tu_diagnostics(translation_unit, "memory_input.c")
         self.tu = translation_unit
         root = self.tu.cursor
@@ -202,8 +411,15 @@ class Clang_Parser:
         # startElement returns None.
         return None
 
-    def register(self, name, obj):
-        """Registers an unique type description"""
+    def register(self, name, obj, usr=None):
+        """Registers an unique type description
+
+        If a clang USR is given, a redeclaration of the same entity, e.g. from
+        another translation unit, is merged with the registered type description.
+        """
+        if usr and usr in self.all_usr:
+            log.debug("register: %s already defined with usr %s", name, usr)
+            return self.all_usr[usr]
         if (name, obj) in self.all_set:
             log.debug("register: %s already defined: %s", name, obj.name)
             return self.all[name]
@@ -220,6 +436,23 @@ class Clang_Parser:
         log.debug("register: %s ", name)
         self.all[name] = obj
         self.all_set.add((name, obj))
+        self._registered_names.append(name)
+        if usr:
+            self.all_usr[usr] = obj
+            self._usr_names[name] = usr
+        return obj
+
+    def replace_registered(self, name, obj):
+        """
+        Replaces a registered type description in place, keeping its registration order.
+        A name already returned by get_result() is not returned again.
+        """
+        if name in self.all:
+            self.all_set.discard((name, self.all[name]))
+        else:
+            self._registered_names.append(name)
+        self.all[name] = obj
+        self.all_set.add((name, obj))
         return obj
 
     def get_registered(self, name):
@@ -230,18 +463,41 @@ class Clang_Parser:
         """Checks if a named type description is registered"""
         return name in self.all
 
+    def get_registered_usr(self, usr):
+        """Returns a type description registered with a clang USR"""
+        return self.all_usr[usr]
+
+    def is_registered_usr(self, usr):
+        """Checks if a type description is registered with a clang USR"""
+        return bool(usr) and usr in self.all_usr
+
     def remove_registered(self, name):
         """Removes a named type"""
         log.debug("Unregister %s", name)
         self.all_set.remove((name, self.all[name]))
         del self.all[name]
+        usr = self._usr_names.pop(name, None)
+        if usr is not None:
+            del self.all_usr[usr]
 
     def make_ctypes_convertor(self, _flags):
         """
         Fix clang types to ctypes conversion for this parsing instance.
         Some architecture dependent size types have to be changed if the target
-        architecture is not the same as local
+        architecture is not the same as local.
+        The tables of a target are computed once, and shared by the parsers of that target.
         """
+        key = tuple(_flags or ())
+        target_types = self._target_tables.get(key)
+        if target_types is None:
+            # two threads may compute the same target, the first one stored is kept
+            target_types = self._target_tables.setdefault(key, self._make_target_types(_flags))
+        self.target_types = target_types
+        self.ctypes_typename = target_types.typenames
+        self.ctypes_sizes = target_types.sizes
+
+    @classmethod
+    def _make_target_types(cls, _flags):
         # NOTE: one could also use the __SIZEOF_x__ MACROs to obtain sizes.
         translation_unit = util.get_tu(
             """
@@ -255,29 +511,31 @@ typedef long double longdouble_t;
 typedef void* pointer_t;""",
             flags=_flags,
         )
+        typenames = dict(cls.ctypes_typename)
+        sizes = {}
         size = util.get_cursor(translation_unit, "short_t").type.get_size() * 8
-        self.ctypes_typename[TypeKind.SHORT] = f"c_int{size:d}"
-        self.ctypes_typename[TypeKind.USHORT] = f"c_uint{size:d}"
-        self.ctypes_sizes[TypeKind.SHORT] = size
-        self.ctypes_sizes[TypeKind.USHORT] = size
+        typenames[TypeKind.SHORT] = f"c_int{size:d}"
+        typenames[TypeKind.USHORT] = f"c_uint{size:d}"
+        sizes[TypeKind.SHORT] = size
+        sizes[TypeKind.USHORT] = size
 
         size = util.get_cursor(translation_unit, "int_t").type.get_size() * 8
-        self.ctypes_typename[TypeKind.INT] = f"c_int{size:d}"
-        self.ctypes_typename[TypeKind.UINT] = f"c_uint{size:d}"
-        self.ctypes_sizes[TypeKind.INT] = size
-        self.ctypes_sizes[TypeKind.UINT] = size
+        typenames[TypeKind.INT] = f"c_int{size:d}"
+        typenames[TypeKind.UINT] = f"c_uint{size:d}"
+        sizes[TypeKind.INT] = size
+        sizes[TypeKind.UINT] = size
 
         size = util.get_cursor(translation_unit, "long_t").type.get_size() * 8
-        self.ctypes_typename[TypeKind.LONG] = f"c_int{size:d}"
-        self.ctypes_typename[TypeKind.ULONG] = f"c_uint{size:d}"
-        self.ctypes_sizes[TypeKind.LONG] = size
-        self.ctypes_sizes[TypeKind.ULONG] = size
+        typenames[TypeKind.LONG] = f"c_int{size:d}"
+        typenames[TypeKind.ULONG] = f"c_uint{size:d}"
+        sizes[TypeKind.LONG] = size
+        sizes[TypeKind.ULONG] = size
 
         size = util.get_cursor(translation_unit, "longlong_t").type.get_size() * 8
-        self.ctypes_typename[TypeKind.LONGLONG] = f"c_int{size:d}"
-        self.ctypes_typename[TypeKind.ULONGLONG] = f"c_uint{size:d}"
-        self.ctypes_sizes[TypeKind.LONGLONG] = size
-        self.ctypes_sizes[TypeKind.ULONGLONG] = size
+        typenames[TypeKind.LONGLONG] = f"c_int{size:d}"
+        typenames[TypeKind.ULONGLONG] = f"c_uint{size:d}"
+        sizes[TypeKind.LONGLONG] = size
+        sizes[TypeKind.ULONGLONG] = size
 
         # FIXME : Float && http://en.wikipedia.org/wiki/Long_double
         size0 = util.get_cursor(translation_unit, "float_t").type.get_size() * 8
@@ -288,25 +546,25 @@ typedef void* pointer_t;""",
         # the idea is that you cannot assume a c_double will be same format as a c_long_double.
         # at least this pass size TU
         if size1 != size2:
-            self.ctypes_typename[TypeKind.LONGDOUBLE] = "c_long_double_t"
+            typenames[TypeKind.LONGDOUBLE] = "c_long_double_t"
         else:
-            self.ctypes_typename[TypeKind.LONGDOUBLE] = "c_double"
+            typenames[TypeKind.LONGDOUBLE] = "c_double"
 
-        self.ctypes_sizes[TypeKind.FLOAT] = size0
-        self.ctypes_sizes[TypeKind.DOUBLE] = size1
-        self.ctypes_sizes[TypeKind.LONGDOUBLE] = size2
+        sizes[TypeKind.FLOAT] = size0
+        sizes[TypeKind.DOUBLE] = size1
+        sizes[TypeKind.LONGDOUBLE] = size2
 
         # save the target pointer size.
         size = util.get_cursor(translation_unit, "pointer_t").type.get_size() * 8
-        self.ctypes_sizes[TypeKind.POINTER] = size
-        self.ctypes_sizes[TypeKind.NULLPTR] = size
+        sizes[TypeKind.POINTER] = size
+        sizes[TypeKind.NULLPTR] = size
 
         log.debug(
             "ARCH sizes: long:%s longdouble:%s",
-            self.ctypes_typename[TypeKind.LONG],
-            self.ctypes_typename[TypeKind.LONGDOUBLE],
+            typenames[TypeKind.LONG],
+            typenames[TypeKind.LONGDOUBLE],
         )
-        return
+        return TargetTypes(types.MappingProxyType(typenames), types.MappingProxyType(sizes))
 
     def get_ctypes_name(self, typekind):
         return self.ctypes_typename[typekind]
@@ -336,7 +594,7 @@ typedef void* pointer_t;""",
             name, body = macro.split(None, 1)
             name, args = name.split("(", 1)
             args = f"({args}"
-            self.all[name] = typedesc.Macro(name, args, body)
+            self.replace_registered(name, typedesc.Macro(name, args, body))
 
     def get_aliases(self, text, namespace):
         if text is None:
@@ -344,14 +602,15 @@ typedef void* pointer_t;""",
         # preprocessor definitions that look like aliases:
         #  #define A B
         text = "".join(text)
-        aliases = {}
+        aliases = self._aliases
+        new_aliases = {}
         for alias in text.splitlines():
             name, value = alias.split(None, 1)
             alias = typedesc.Alias(name, value)
-            aliases[name] = alias
-            self.all[name] = alias
+            aliases[name] = new_aliases[name] = alias
+            self.replace_registered(name, alias)
 
-        for name, alias in aliases.items():
+        for name, alias in new_aliases.items():
             value = alias.alias
             # the value should be either in namespace...
             if value in namespace:
@@ -367,6 +626,12 @@ typedef void* pointer_t;""",
                 pass
 
     def get_result(self):
+        """
+        Returns the type descriptions registered since the previous call.
+
+        Only the items registered after the last call are fixed up and returned,
+        so calling this after each parsed file does not rescan the whole registry.
+        """
         # all of these should register()
         interesting = (
             typedesc.Typedef,
@@ -382,10 +647,11 @@ typedef void* pointer_t;""",
         )
         # typedesc.Field) #???
 
-        self.get_macros(self.cpp_data.get("functions"))
-        # fix all objects after that all are resolved
+        self.get_macros(self._new_cpp_data("functions"))
+        # fix all new objects after that all are resolved
         remove = []
-        for _id, _item in self.all.items():
+        for _id in self._new_registered_names():
+            _item = self.all[_id]
             if _item is None:
                 log.warning("ignoring %s", _id)
                 continue
@@ -403,21 +669,45 @@ typedef void* pointer_t;""",
         for _x in remove:
             self.remove_registered(_x)
 
-        # Now we can build the namespace.
-        namespace = {}
-        for i in self.all.values():
+        # Now we can extend the namespace.
+        for _id in self._new_registered_names():
+            i = self.all[_id]
             if not isinstance(i, interesting):
                 log.debug("ignoring %s", i)
                 continue  # we don't want these
             name = getattr(i, "name", None)
             if name is not None:
-                namespace[name] = i
-        self.get_aliases(self.cpp_data.get("aliases"), namespace)
+                self._namespace[name] = i
+        self.get_aliases(self._new_cpp_data("aliases"), self._namespace)
 
         result = []
-        for i in self.all.values():
+        for _id in self._new_registered_names():
+            i = self.all[_id]
             if isinstance(i, interesting):
                 result.append(i)
+        self._result_index = len(self._registered_names)
+        if self.incremental:
+            self._index_dependencies()
 
         log.debug("parsed items order: %s", result)
         return result
+
+    def _new_cpp_data(self, kind):
+        """Returns the lines of cpp_data added for kind since the last get_result(), or None"""
+        lines = self.cpp_data.get(kind)
+        if lines is None:
+            return None
+        start = self._cpp_data_index.get(kind, 0)
+        self._cpp_data_index[kind] = len(lines)
+        return lines[start:]
+
+    def _new_registered_names(self):
+        """Returns the still registered names, registered since the last get_result(), in order"""
+        seen = set()
+        names = []
+        for name in self._registered_names[self._result_index:]:
+            if name in seen or name not in self.all:
+                continue
+            seen.add(name)
+            names.append(name)
+        return names
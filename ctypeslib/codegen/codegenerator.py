@@ -7,12 +7,19 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import collections
+import compileall
 import ctypes
+import importlib.util
 import logging
 import os
 import pkgutil
+import py_compile
+import re
+import shutil
 import sys
+import tempfile
 import textwrap
+import zlib
 import io
 from io import StringIO
 
@@ -20,17 +27,62 @@ from clang.cindex import TypeKind
 
 from ctypeslib.codegen import clangparser
 from ctypeslib.codegen import config
+from ctypeslib.codegen import symbolindex
 from ctypeslib.codegen import typedesc
 from ctypeslib.codegen import util
-from ctypeslib.library import Library
+from ctypeslib.library import Library, LibraryIndex
 
 log = logging.getLogger("codegen")
 
 
+def _identifier(expression):
+    """Returns a python identifier made of the names in a type expression"""
+    expression = expression.replace("ctypes.", "")
+    return "_".join(re.findall(r"\w+", expression))
+
+
+def _type_key(t):
+    """
+    Returns a key equal for type descriptions that have the same type_name.
+    The parser makes a new description for each use of a fundamental, pointer or array type.
+    """
+    if isinstance(t, typedesc.FundamentalType):
+        return t.name
+    if isinstance(t, typedesc.PointerType):
+        return "*", _type_key(t.typ)
+    if isinstance(t, typedesc.ArrayType):
+        return "[]", _type_key(t.typ), t.size
+    if isinstance(t, typedesc.FunctionType):
+        args = tuple(_type_key(a) for a in t.iterArgTypes())
+        return "()", "__stdcall__" in t.attributes, _type_key(t.returns), args
+    return t
+
+
+def _referenced_types(item):
+    """Returns the types an item refers to in its declaration"""
+    if isinstance(item, (typedesc.Structure, typedesc.Union)):
+        fields = [m.type for m in item.members or [] if isinstance(m, typedesc.Field)]
+        return list(item.bases) + fields
+    if isinstance(item, typedesc.Function):
+        return [item.returns] + list(item.iterArgTypes())
+    if isinstance(item, (typedesc.Typedef, typedesc.Variable)):
+        return [item.typ]
+    return []
+
+
 class Generator:
+    """
+    Writes the python code of type descriptions.
+    A generator is not thread safe, but generators in different threads are independent,
+    as long as they do not share a CodegenConfig, nor a parser.
+    """
+    # the generated body is spooled to a temporary file past that size
+    spool_max_size = 16 * 1024 * 1024
+
     def __init__(self, output, cfg):
         self.output = output
-        self.stream = StringIO()
+        # self.imports is written before self.stream, but is filled late, while generating the body.
+        self._stream = None
         self.imports = StringIO()
         self.cfg = cfg
         self.generate_locations = cfg.generate_locations
@@ -42,6 +94,7 @@ class Generator:
             self.searched_dlls = []
         else:
             self.searched_dlls = cfg.searched_dlls
+        self.library_index = LibraryIndex(self.searched_dlls)
 
         # we use collections.OrderedDict() to keep ordering
         self.done = collections.OrderedDict()  # type descriptions that have been generated
@@ -52,6 +105,26 @@ class Generator:
         # what record dependency were generated
         self.head_generated = set()
         self.body_generated = set()
+        # signature table entries of functions bound on first access
+        self.lazy_functions = cfg.lazy_functions
+        self.lazy_function_entries = []
+        self.lazy_libraries = cfg.lazy_libraries
+        # record heads and bodies waiting to be written as a table
+        self.record_tables = cfg.record_tables
+        self._record_table = []
+        # type key -> module level alias, and how many times each type is written
+        self.hoist_types = cfg.hoist_types
+        self._type_aliases = {}
+        self._type_uses = collections.Counter()
+        # type key -> expression returned by type_name
+        self._type_names = {}
+
+    @property
+    def stream(self):
+        """The generated body, spooled to a temporary file, that is only created on first use"""
+        if self._stream is None:
+            self._stream = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, mode="w+", encoding="utf-8")
+        return self._stream
 
     # pylint: disable=method-hidden
     def enable_fundamental_type_wrappers(self):
@@ -104,6 +177,39 @@ class Generator:
         headers = headers.replace("__POINTER_TYPE__", self.enable_pointer_type())
         print(headers, file=self.imports)
 
+    def enable_record_tables(self):
+        """
+        If records are declared from tables, declare the functions building them.
+        """
+        self.enable_record_tables = lambda: True
+        headers = pkgutil.get_data("ctypeslib", "data/record_table.tpl").decode()
+        print(headers, file=self.imports)
+
+    def flush_record_tables(self):
+        """
+        Writes the pending record heads and bodies, as a single constant table.
+        Called before anything else is written, that may refer to the pending records.
+        """
+        if not self._record_table:
+            return
+        print("_make_records(globals(), (", file=self.stream)
+        for row in self._record_table:
+            print("    %r," % (row,), file=self.stream)
+        print("))\n", file=self.stream)
+        self._record_table = []
+
+    def enable_lazy_library(self):
+        """
+        If shared libraries are loaded on first use, declare the LazyLibrary type,
+        and the libraries to preload before the first one.
+        """
+        self.enable_lazy_library = lambda: True
+        headers = pkgutil.get_data("ctypeslib", "data/lazy_library.tpl").decode()
+        print(headers, file=self.imports)
+        if self.preloaded_dlls:
+            preloads = [getattr(dll, "_filepath", getattr(dll, "_name", dll)) for dll in self.preloaded_dlls]
+            print("LazyLibrary._preloads = %r" % preloads, file=self.imports)
+
     def generate_headers(self, parser):
         # fix parser in self for later use
         self.parser = parser
@@ -124,7 +230,18 @@ class Generator:
         Returns a string containing an expression that can be used to
         refer to the type. Assumes the 'from ctypes import *'
         namespace is available.
+        The expression is computed, and its dependencies enabled, once per type.
         """
+        key = _type_key(t)
+        try:
+            return self._type_names[key]
+        except KeyError:
+            pass
+        name = self._type_name(t, generate)
+        self._type_names[key] = name
+        return name
+
+    def _type_name(self, t, generate):
         # no Test case for these
         # elif isinstance(t, typedesc.Argument):
         # elif isinstance(t, typedesc.CvQualifiedType):
@@ -142,20 +259,25 @@ class Generator:
             #     pointer_class = self.enable_pointer_type()
             #     return "%s(%s)" % (pointer_class, self.type_name(t.typ, generate))
             # else:
-            return "%s * %s" % (self.type_name(t.typ, generate), t.size)
+            item_type = self.type_name(t.typ, generate)
+            return self.hoist_type(t, "%s * %s" % (item_type, t.size), "_arr_%s_%s" % (_identifier(item_type), t.size))
         if isinstance(t, typedesc.PointerType) and isinstance(t.typ, typedesc.FunctionType):
             return self.type_name(t.typ, generate)
         if isinstance(t, typedesc.PointerType):
             pointer_class = self.enable_pointer_type()
             if t.typ.name in ["c_ubyte", "c_char"]:
                 self.enable_string_cast()
-            return "%s(%s)" % (pointer_class, self.type_name(t.typ, generate))
+            target_type = self.type_name(t.typ, generate)
+            return self.hoist_type(t, "%s(%s)" % (pointer_class, target_type), "_ptr_%s" % _identifier(target_type))
         if isinstance(t, typedesc.FunctionType):
             args = [self.type_name(x, generate) for x in [t.returns] + list(t.iterArgTypes())]
             if "__stdcall__" in t.attributes:
-                return "ctypes.WINFUNCTYPE(%s)" % ", ".join(args)
+                expression = "ctypes.WINFUNCTYPE(%s)" % ", ".join(args)
+                alias = "_winfn_%s" % _identifier(", ".join(args))
             else:
-                return "ctypes.CFUNCTYPE(%s)" % ", ".join(args)
+                expression = "ctypes.CFUNCTYPE(%s)" % ", ".join(args)
+                alias = "_fn_%s" % _identifier(", ".join(args))
+            return self.hoist_type(t, expression, alias)
         # elif isinstance(t, typedesc.Structure):
         # elif isinstance(t, typedesc.Typedef):
         # elif isinstance(t, typedesc.Union):
@@ -163,6 +285,75 @@ class Generator:
         # All typedesc typedefs should be handled
         # raise TypeError('This typedesc should be handled %s'%(t))
 
+    def count_type_uses(self, items):
+        """
+        Counts how many times the type expression of each type would be written for items,
+        as the declarations and the expressions of other types refer to it.
+        """
+        counted = set()
+
+        def count(t):
+            if isinstance(t, typedesc.PointerType) and isinstance(t.typ, typedesc.FunctionType):
+                t = t.typ
+            key = _type_key(t)
+            self._type_uses[key] += 1
+            # the expressions a type is made of are counted once, as if it was hoisted
+            if key in counted:
+                return
+            counted.add(key)
+            if isinstance(t, (typedesc.PointerType, typedesc.ArrayType)):
+                count(t.typ)
+            elif isinstance(t, typedesc.FunctionType):
+                for x in [t.returns] + list(t.iterArgTypes()):
+                    count(x)
+
+        for item in items:
+            for t in _referenced_types(item):
+                count(t)
+
+    def hoist_type(self, t, expression, alias):
+        """
+        If types are hoisted, and declaring expression once under the alias name makes
+        the module smaller, declares it and returns the alias. Otherwise returns expression.
+        The alias is derived from the type, so it does not depend on the order of the items.
+        """
+        if not self.hoist_types:
+            return expression
+        uses = self._type_uses[_type_key(t)]
+        declaration = "%s = %s\n" % (alias, expression)
+        if uses * (len(expression) - len(alias)) <= len(declaration):
+            return expression
+        if alias in self._type_aliases.values():
+            alias = "%s_%08x" % (alias, zlib.crc32(expression.encode()))
+        self._type_aliases[_type_key(t)] = alias
+        # the expression may refer to pending records
+        self.flush_record_tables()
+        print("%s = %s" % (alias, expression), file=self.stream)
+        return alias
+
+    def type_spec(self, t):
+        """
+        Returns a constant describing the type, as resolved by _make_records:
+        a name, ('*', type, length) for arrays, or (callable, type, ...).
+        type_name must have been called on t first, to 'import' the types it needs.
+        """
+        if isinstance(t, typedesc.FundamentalType):
+            name = self.FundamentalType(t)
+            return None if name == "None" else name
+        if _type_key(t) in self._type_aliases:
+            # already declared by type_name
+            return self._type_aliases[_type_key(t)]
+        if isinstance(t, typedesc.ArrayType):
+            return ("*", self.type_spec(t.typ), t.size)
+        if isinstance(t, typedesc.PointerType) and isinstance(t.typ, typedesc.FunctionType):
+            return self.type_spec(t.typ)
+        if isinstance(t, typedesc.PointerType):
+            return (self.enable_pointer_type(), self.type_spec(t.typ))
+        if isinstance(t, typedesc.FunctionType):
+            factory = "ctypes.WINFUNCTYPE" if "__stdcall__" in t.attributes else "ctypes.CFUNCTYPE"
+            return (factory,) + tuple(self.type_spec(x) for x in [t.returns] + list(t.iterArgTypes()))
+        return t.name
+
     ################################################################
 
     _aliases = 0
@@ -625,8 +816,18 @@ class Generator:
             self._generate(struct.get_head())
             # add dependencies
             self.more[struct] = True
+        if inline and self.hoist_types:
+            # declare the field types before the class statement opens
+            for m in head.struct.members or []:
+                if isinstance(m, typedesc.Field):
+                    self.type_name(m.type)
         basenames = [self.type_name(b) for b in head.struct.bases]
-        if basenames:
+        if self.record_tables:
+            self.enable_record_tables()
+            if not basenames:
+                basenames = ["Union" if isinstance(head.struct, typedesc.Union) else "Structure"]
+            self._record_table.append((head.struct.name, tuple(basenames)))
+        elif basenames:
             # method_names = [m.name for m in head.struct.members if type(m) is typedesc.Method]
             print(
                 "class %s(%s):" % (head.struct.name, ", ".join(basenames)),
@@ -639,10 +840,12 @@ class Generator:
                 print("class %s(Structure):" % head.struct.name, file=self.stream)
             elif isinstance(head.struct, typedesc.Union):
                 print("class %s(Union):" % head.struct.name, file=self.stream)
-        if not inline:
+        if self.record_tables:
+            pass
+        elif not inline:
             print("    pass\n", file=self.stream)
         # special empty struct
-        if inline and not head.struct.members:
+        elif not head.struct.members:
             print("    pass\n", file=self.stream)
         self.names.append(head.struct.name)
         log.debug("Head finished for %s", head.name)
@@ -679,7 +882,7 @@ class Generator:
             pass
         # LXJ: we pack all the time, because clang gives a precise field offset
         # per target architecture. No need to defer to ctypes logic for that.
-        if fields:
+        if fields and not self.record_tables:
             print("%s_pack_ = 1 # source:%s" % (prefix, body.struct.packed), file=self.stream)
 
         if body.struct.bases:
@@ -705,10 +908,12 @@ class Generator:
                 if f.name == '':
                     unnamed_fields[f] = "_%d" % len(unnamed_fields)
                 # otherwise, we want to keep that field's name
-        if unnamed_fields:
+        if self.record_tables:
+            self._record_body_row(body, fields, unnamed_fields)
+        elif unnamed_fields:
             unnamed_fields_str = ", ".join("'%s'" % _ for _ in unnamed_fields.values())
             print("%s_anonymous_ = (%s,)" % (prefix, unnamed_fields_str), file=self.stream)
-        if len(fields) > 0:
+        if len(fields) > 0 and not self.record_tables:
             print("%s_fields_ = [" % prefix, file=self.stream)
             if self.generate_locations and body.struct.location:
                 print("    # %s %s" % body.struct.location, file=self.stream)
@@ -734,20 +939,21 @@ class Generator:
         log.debug("Body finished for %s", body.name)
         self.body_generated.add(body.name)
 
-    def find_library_with_func(self, func):
-        if hasattr(func, "dllname"):
-            return func.dllname
-        name = func.name
-        if os.name == "posix" and sys.platform == "darwin":
-            name = "_%s" % name
-        for dll in self.searched_dlls:
-            try:
-                getattr(dll, name)
-            except AttributeError:
-                pass
+    def _record_body_row(self, body, fields, unnamed_fields):
+        """Adds the _fields_ of a record to the pending record table"""
+        if not fields:
+            return
+        rows = []
+        for f in fields:
+            fieldname = unnamed_fields.get(f, f.name)
+            if f.is_bitfield is False:
+                rows.append((fieldname, self.type_spec(f.type)))
             else:
-                return dll
-        return None
+                rows.append((fieldname, self.type_spec(f.type), f.bits))
+        self._record_table.append((body.struct.name, tuple(rows), tuple(unnamed_fields.values())))
+
+    def find_library_with_func(self, func):
+        return self.library_index.find_function(func)
 
     _c_libraries = None
 
@@ -789,7 +995,12 @@ class Generator:
         if cc == "stdcall":
             self.need_WinLibraries()
             if library._name not in self._stdcall_libraries:
-                _ = "_stdcall_libraries[%r] =%s ctypes.WinDLL(%r)" % (library._name, stub_comment, library._filepath)
+                if self.lazy_libraries:
+                    self.enable_lazy_library()
+                    _ = "_stdcall_libraries[%r] =%s LazyLibrary(ctypes.WinDLL, %r)" % (
+                        library._name, stub_comment, library._filepath)
+                else:
+                    _ = "_stdcall_libraries[%r] =%s ctypes.WinDLL(%r)" % (library._name, stub_comment, library._filepath)
                 print(_, file=self.imports)
                 self._stdcall_libraries[library._name] = None
             return "_stdcall_libraries[%r]" % library._name
@@ -801,8 +1012,13 @@ class Generator:
         else:
             global_flag = ""
         if library._name not in self._c_libraries:
-            print("_libraries[%r] =%s ctypes.CDLL(%r%s)" % (library._name, stub_comment, library._filepath, global_flag),
-                  file=self.imports)
+            if self.lazy_libraries:
+                self.enable_lazy_library()
+                print("_libraries[%r] =%s LazyLibrary(ctypes.CDLL, %r%s)" % (
+                    library._name, stub_comment, library._filepath, global_flag), file=self.imports)
+            else:
+                print("_libraries[%r] =%s ctypes.CDLL(%r%s)" % (
+                    library._name, stub_comment, library._filepath, global_flag), file=self.imports)
             self._c_libraries[library._name] = None
         return "_libraries[%r]" % library._name
 
@@ -853,16 +1069,7 @@ class Generator:
 
         if self.generate_locations and func.location:
             print("# %s %s" % func.location, file=self.stream)
-        # Generate the function decl code
-        print("try:", file=self.stream)
-        print("    %s = %s.%s" % (func.name, libname, func.name), file=self.stream)
-        print("    %s.restype = %s" % (func.name, self.type_name(func.returns)), file=self.stream)
-        if self.generate_comments:
-            print("# %s(%s)" % (func.name, ", ".join(argnames)), file=self.stream)
-        print("    %s.argtypes = [%s]" % (func.name, ", ".join(args)), file=self.stream)
-        print("except AttributeError:", file=self.stream)
-        print("    pass", file=self.stream)
-
+        doc = None
         if self.generate_docstrings:
 
             def typeString(typ):
@@ -874,18 +1081,37 @@ class Generator:
                     return "unknown"
 
             argsAndTypes = zip([typeString(t) for t in func.iterArgTypes()], argnames)
-            print(
-                '{funcname}.__doc__ = """{ret} {funcname}({args})\n'
-                '    {file}:{line}"""'.format(
-                    funcname=func.name,
-                    args=", ".join(["%s %s" % i for i in argsAndTypes]),
-                    file=func.location[0],
-                    line=func.location[1],
-                    ret=typeString(func.returns),
-                ),
-                file=self.stream,
+            doc = '{ret} {funcname}({args})\n    {file}:{line}'.format(
+                funcname=func.name,
+                args=", ".join(["%s %s" % i for i in argsAndTypes]),
+                file=func.location[0],
+                line=func.location[1],
+                ret=typeString(func.returns),
             )
 
+        if self.lazy_functions:
+            # only a signature table entry, the function is bound on first access
+            self.lazy_function_entries.append(
+                "    %r: (%s, %s, [%s], %r)," % (func.name, libname, self.type_name(func.returns), ", ".join(args), doc)
+            )
+            self.names.append(func.name)
+            self._functiontypes += 1
+            return
+
+        # Generate the function decl code
+        restype = self.type_name(func.returns)
+        print("try:", file=self.stream)
+        print("    %s = %s.%s" % (func.name, libname, func.name), file=self.stream)
+        print("    %s.restype = %s" % (func.name, restype), file=self.stream)
+        if self.generate_comments:
+            print("# %s(%s)" % (func.name, ", ".join(argnames)), file=self.stream)
+        print("    %s.argtypes = [%s]" % (func.name, ", ".join(args)), file=self.stream)
+        print("except AttributeError:", file=self.stream)
+        print("    pass", file=self.stream)
+
+        if doc is not None:
+            print('%s.__doc__ = """%s"""' % (func.name, doc), file=self.stream)
+
         self.names.append(func.name)
         self._functiontypes += 1
         return
@@ -906,10 +1132,19 @@ class Generator:
 
     ########
 
+    # the type descriptions written in a record table, or that write no statement of their own
+    _record_parts = (typedesc.Structure, typedesc.Union, typedesc.StructureHead, typedesc.StructureBody,
+                     typedesc.PointerType, typedesc.ArrayType, typedesc.FunctionType, typedesc.Argument,
+                     typedesc.CvQualifiedType, typedesc.FundamentalType)
+
     def _generate(self, item, *args):
         """ wraps execution of specific methods."""
         if item in self.done:
             return
+        # the pending record table is written before any other statement
+        if self._record_table and (self.generate_locations or self.generate_comments
+                                   or not isinstance(item, self._record_parts)):
+            self.flush_record_tables()
         # verbose output with location.
         if self.generate_locations and item.location:
             print("# %s:%d" % item.location, file=self.stream)
@@ -961,17 +1196,30 @@ class Generator:
         return self.generate_code(items)
 
     def generate_code(self, items):
-        print(
-            "\n".join(
-                ["ctypes.CDLL('%s', ctypes.RTLD_GLOBAL)" % preloaded_dll for preloaded_dll in self.preloaded_dlls]
-            ),
-            file=self.imports,
-        )
+        if not self.lazy_libraries:
+            print(
+                "\n".join(
+                    ["ctypes.CDLL('%s', ctypes.RTLD_GLOBAL)" % preloaded_dll for preloaded_dll in self.preloaded_dlls]
+                ),
+                file=self.imports,
+            )
+        if self.hoist_types:
+            self.count_type_uses(items)
         loops = self.generate_items(items)
+        if self.lazy_libraries and self.preloaded_dlls and not self.enable_lazy_library():
+            # no library of the module loads them on first use, they are loaded on import
+            print("LazyLibrary.preload()", file=self.imports)
+        if self.record_tables:
+            self.flush_record_tables()
+        if self.lazy_function_entries:
+            self.print_lazy_functions()
 
         self.output.write(self.imports.getvalue())
         self.output.write("\n\n")
-        self.output.write(self.stream.getvalue())
+        if self._stream is not None:
+            self._stream.seek(0)
+            shutil.copyfileobj(self._stream, self.output)
+            self._stream.close()
 
         text = "__all__ = \\"
         # text Wrapper doesn't work for the first line in certain cases.
@@ -984,6 +1232,14 @@ class Generator:
 
         return loops
 
+    def print_lazy_functions(self):
+        """Print the signature table of foreign functions, and the module __getattr__ binding them"""
+        print("_lazy_functions = {", file=self.stream)
+        for entry in self.lazy_function_entries:
+            print(entry, file=self.stream)
+        print("}", file=self.stream)
+        print(pkgutil.get_data("ctypeslib", "data/lazy_function.tpl").decode(), file=self.stream)
+
     def print_stats(self, stream):
         total = (
             self._structures
@@ -1022,165 +1278,524 @@ class CodeTranslator:
         self.cfg = cfg
         self.parser = None
         self.generator = None
+        # the clang Index given to the parser, None for a new one per file
+        self.index = None
+        # shared by all generators
+        self.library_index = LibraryIndex(cfg.searched_dlls or [])
         self.items = []
+        # the source files, and the files they include, that were parsed
+        self.input_files = collections.OrderedDict()
         self.filtered_items = []
+        self.filter_stats = collections.Counter()
 
     def preload_dlls(self):
         # FIXME
         self.cfg.preloaded_dlls = [Library(name, nm="nm") for name in self.cfg.preloaded_dlls]
 
     def make_clang_parser(self):
-        self.parser = clangparser.Clang_Parser(self.cfg.clang_opts)
+        self.parser = clangparser.Clang_Parser(self.cfg.clang_opts, self.index)
         if typedesc.Macro in self.cfg.types:
             self.parser.activate_macros_parsing()
         if self.cfg.generate_comments:
             self.parser.activate_comment_parsing()
+        if self.cfg.incremental:
+            self.parser.activate_incremental_parsing()
         # FIXME
         # if self.cfg.filter_location:
         #     parser.filter_location(srcfiles)
         return self.parser
 
-    def parse_input_string(self, input_io):
+    def parse_input_string(self, input_io, unsaved_files=None):
         if self.parser is None:
             self.make_clang_parser()
-        self.parser.parse_string(input_io)
+        self.parser.parse_string(input_io, unsaved_files=unsaved_files)
+        self._add_included_files()
         # get the typedesc C types items
         self.items.extend(self.parser.get_result())
 
-    def parse_input_file(self, src_file):
+    def _add_included_files(self):
+        for inclusion in self.parser.tu.get_includes():
+            self.input_files[inclusion.include.name] = True
+
+    def parse_input_file(self, src_file, unsaved_files=None):
         if self.parser is None:
             self.make_clang_parser()
-        self.parser.parse(src_file)
+        self.parser.parse(src_file, unsaved_files)
+        self.input_files[src_file] = True
+        self._add_included_files()
         # get the typedesc C types items
         self.items.extend(self.parser.get_result())
 
-    def parse_input_files(self, src_files: list):
+    def parse_input_files(self, src_files: list, unsaved_files=None):
         if self.parser is None:
             self.make_clang_parser()
+        if unsaved_files:
+            self.parser.add_unsaved_files(unsaved_files)
         # filter location with clang.
         if self.cfg.filter_location:
             self.parser.filter_location(src_files)
         #
         for srcfile in src_files:
-            # verifying that is really a file we can open
-            with open(srcfile):
-                pass
+            # verifying that is really a file we can open, unless it is held in memory
+            if os.path.abspath(srcfile) not in self.parser.unsaved_files:
+                with open(srcfile):
+                    pass
             log.debug("Parsing input file %s", srcfile)
             self.parser.parse(srcfile)
+            self.input_files[srcfile] = True
+            self._add_included_files()
         # get the typedesc C types items
         self.items.extend(self.parser.get_result())
 
+    def reparse(self, changed_files):
+        """
+        Updates the items after a change of some input files, or of files they include.
+        The new items take the place of the ones they replace.
+        """
+        removed = set(self.parser.reparse(changed_files))
+        for translation_unit in self.parser.translation_units.values():
+            for inclusion in translation_unit.get_includes():
+                self.input_files[inclusion.include.name] = True
+        positions = {item: i for i, item in enumerate(self.items)}
+        replaced = {item.name: positions[item] for item in removed if item in positions}
+        ordered = [((i, 0, 0), item) for item, i in positions.items() if item not in removed]
+        # a new declaration goes before the next replaced one, or after the last one
+        new = []
+        position = None
+        for n, item in enumerate(self.parser.get_result()):
+            if item.name in replaced:
+                position = replaced[item.name]
+                ordered.extend(((position, -1, k), _) for k, _ in new)
+                ordered.append(((position, 0, 0), item))
+                new = []
+            else:
+                new.append((n, item))
+        if position is None:
+            position = len(self.items)
+        ordered.extend(((position, 1, k), _) for k, _ in new)
+        ordered.sort(key=lambda _: _[0])
+        self.items = [item for _, item in ordered]
+        log.debug("%d items replaced, %d items now", len(removed), len(self.items))
+
+    def write_symbol_index(self, filename):
+        """Write a SQLite index of all the type descriptions in the parser registry"""
+        with symbolindex.SymbolIndex.create(filename, self.parser.all.values()):
+            pass
+
     def make_code_generator(self, output):
         self.generator = Generator(output, cfg=self.cfg)
+        self.generator.library_index = self.library_index
         return self.generator
 
-    def generate_code(self, output):
-        if self.generator is None:
-            self.make_code_generator(output)
+    def select_items(self):
         self.filtered_items = list(self.items)
         log.debug("%d items before filtering", len(self.filtered_items))
-        self.filter_types()
-        self.filter_symbols()
-        self.filter_expressions()
+        self.filter_stats = collections.Counter()
+        self.filter_items()
+        if self.cfg.prune_unreachable:
+            self.prune_unreachable()
         log.debug("Left with %d items after filtering", len(self.filtered_items))
+
+    def generate_code(self, output):
+        if self.generator is None:
+            self.make_code_generator(output)
+        self.select_items()
         loops = self.generator.generate(self.parser, self.filtered_items)
         if self.cfg.verbose:
             self.generator.print_stats(sys.stderr)
+            log.info("selected %d items by kind, %d by symbol, %d by regex", self.filter_stats["kind"],
+                     self.filter_stats["symbol"], self.filter_stats["regex"])
             log.info("needed %d loop(s)", loops)
 
     def filter_types(self):
-        self.filtered_items = [i for i in self.filtered_items if i.__class__ in self.cfg.types]
+        self.filter_items(symbols=False, expressions=False)
 
     def filter_symbols(self):
-        if len(self.cfg.symbols) == 0:
-            return
-        todo = []
-        syms = set(self.cfg.symbols)
-        for i in self.filtered_items:
-            if i.name in syms:
-                todo.append(i)
-                syms.remove(i.name)
-            else:
-                log.debug("not generating {}: not a symbol".format(i.name))
-        if syms:
-            log.warning("symbols not found %s", [str(x) for x in list(syms)])
-        self.filtered_items = todo
+        self.filter_items(types=False, expressions=False)
 
     def filter_expressions(self):
-        if len(self.cfg.expressions) == 0:
-            return
+        self.filter_items(types=False, symbols=False)
+
+    def filter_items(self, types=True, symbols=True, expressions=True):
+        """
+        Select items by kind, then by symbol name, then by regular expression, in a single pass.
+        An item is kept if it passes every filter. The symbols or expressions filter keeps
+        every item when there are no symbols or no expressions.
+        """
+        kinds = frozenset(self.cfg.types) if types else None
+        names = set(self.cfg.symbols) if symbols else set()
+        expression = self._compile_expressions() if expressions else None
+        stats = collections.Counter()
+        found = set()
+        selected = set()
         todo = []
-        for s in self.cfg.expressions:
-            log.debug("regexp: looking for %s", s.pattern)
-            for i in self.filtered_items:
-                log.debug("regexp: i.name is %s", i.name)
-                if i.name is None:
+        for i in self.filtered_items:
+            if kinds is not None:
+                if i.__class__ not in kinds:
                     continue
-                match = s.match(i.name)
-                # if we only want complete matches:
-                if match and match.group() == i.name:
-                    todo.append(i)
+                stats["kind"] += 1
+            if names:
+                # keep the first item of each symbol name only
+                if i.name not in names or i.name in found:
                     continue
-                # if we follow our own documentation,
-                # allow regular expression match of any part of name:
-                match = s.search(i.name)
-                if match:
-                    todo.append(i)
+                stats["symbol"] += 1
+                found.add(i.name)
+            if expression is not None:
+                if i.name is None or not expression(i.name):
                     continue
+                stats["regex"] += 1
+            # keep the first occurrence only
+            if i in selected:
+                continue
+            selected.add(i)
+            todo.append(i)
+        if names - found:
+            log.warning("symbols not found %s", [str(x) for x in names - found])
+        self.filter_stats.update(stats)
         self.filtered_items = todo
 
+    def _compile_expressions(self):
+        """
+        Returns a search function matching any of the expressions, or None.
+        The expressions compiled with the same flags are combined in a single regex,
+        except those with groups, that a backreference may number.
+        """
+        regexes = [re.compile(e) for e in self.cfg.expressions]
+        if not regexes:
+            return None
+        by_flags = collections.OrderedDict()
+        searches = []
+        for r in regexes:
+            if r.groups:
+                # combining renumbers the groups after the first pattern
+                searches.append(r.search)
+            else:
+                by_flags.setdefault(r.flags, []).append(r)
+        for flags, group in by_flags.items():
+            try:
+                searches.append(re.compile("|".join("(?:%s)" % r.pattern for r in group), flags).search)
+            except re.error:
+                # some patterns (i.e. global inline flags) can not be combined
+                searches.extend(r.search for r in group)
+        if len(searches) == 1:
+            return searches[0]
+        return lambda name: any(search(name) for search in searches)
+
+    def is_root(self, item):
+        """
+        Roots of the reachable items are symbols explicitly requested, variables, macros
+        and functions. When libraries are searched, only functions they export are roots.
+        """
+        if self.cfg.symbols or self.cfg.expressions:
+            return True
+        if isinstance(item, typedesc.Function):
+            if self.cfg.searched_dlls:
+                return self.library_index.find_function(item) is not None
+            return True
+        return isinstance(item, (typedesc.Variable, typedesc.Macro, typedesc.Alias))
+
+    def prune_unreachable(self):
+        """Only keep items in the transitive closure of root items over the typedesc graph"""
+        reachable = set()
+        todo = [i for i in self.filtered_items if self.is_root(i)]
+        while todo:
+            item = todo.pop()
+            if item in reachable:
+                continue
+            reachable.add(item)
+            todo.extend(typedesc.dependencies(item))
+        before = len(self.filtered_items)
+        self.filtered_items = [i for i in self.filtered_items if i in reachable]
+        log.debug("pruned %d unreachable items", before - len(self.filtered_items))
+
+    # named declarations that can be imported from another generated module
+    _importable = (typedesc.Structure, typedesc.Union, typedesc.Typedef, typedesc.Enumeration,
+                   typedesc.Function, typedesc.Variable, typedesc.Macro, typedesc.Alias)
+
+    def _group_by_module(self):
+        """
+        Groups the selected items by source file, then merges source files that depend on each other
+        in strongly connected groups, so that the generated modules do not import each other in a cycle.
+        Returns a list of (source files, items, foreign dependencies) tuples, in dependency order.
+        """
+        def source_of(item):
+            if isinstance(item, self._importable) and item.location and item.name:
+                return item.location[0]
+            return None
+
+        files = collections.OrderedDict()
+        foreign = collections.defaultdict(collections.OrderedDict)
+        edges = collections.defaultdict(set)
+        todo = [(item, source_of(item)) for item in self.filtered_items]
+        grouped = set()
+        while todo:
+            root, filename = todo.pop(0)
+            if root in grouped:
+                continue
+            grouped.add(root)
+            files.setdefault(filename, []).append(root)
+            seen = {root}
+            walk = typedesc.dependencies(root)
+            while walk:
+                dep = walk.pop()
+                if dep in seen:
+                    continue
+                seen.add(dep)
+                dep_filename = source_of(dep)
+                if dep_filename is not None and dep_filename != filename:
+                    # defined in another module
+                    foreign[filename][dep] = None
+                    edges[filename].add(dep_filename)
+                    todo.append((dep, dep_filename))
+                    continue
+                walk.extend(typedesc.dependencies(dep))
+
+        # Tarjan's strongly connected components, emitted in dependency order
+        index = {}
+        lowlink = {}
+        stack = []
+        components = []
+
+        def strongconnect(node):
+            index[node] = lowlink[node] = len(index)
+            stack.append(node)
+            for other in edges[node]:
+                if other not in index:
+                    strongconnect(other)
+                    lowlink[node] = min(lowlink[node], lowlink[other])
+                elif other in stack:
+                    lowlink[node] = min(lowlink[node], index[other])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    other = stack.pop()
+                    component.append(other)
+                    if other == node:
+                        break
+                components.append(sorted(component, key=list(files).index))
+
+        for filename in files:
+            if filename not in index:
+                strongconnect(filename)
+
+        groups = []
+        for component in components:
+            items = [item for filename in component for item in files[filename]]
+            deps = [dep for filename in component for dep in foreign[filename]
+                    if source_of(dep) not in component]
+            groups.append((component, items, list(collections.OrderedDict.fromkeys(deps))))
+        return groups
+
+    @staticmethod
+    def _module_name(filename, used):
+        if filename is None:
+            name = "_common"
+        else:
+            name = re.sub(r"\W", "_", os.path.splitext(os.path.basename(filename))[0])
+            if not name or name[0].isdigit() or name == "__init__":
+                name = "_" + name
+        unique = name
+        i = 1
+        while unique in used:
+            unique = "%s_%d" % (name, i)
+            i += 1
+        used.add(unique)
+        return unique
+
+    def generate_package(self, directory):
+        """
+        Write a package in directory, with one submodule per source file, or per group of source files
+        that depend on each other. The package __init__ only imports a submodule when one of its symbols
+        is first accessed.
+        """
+        self.select_items()
+        os.makedirs(directory, exist_ok=True)
+        modules = {}
+        used = set()
+        module_names = []
+        symbols = collections.OrderedDict()
+        for component, items, deps in self._group_by_module():
+            module = self._module_name(component[0], used)
+            module_names.append(module)
+            for filename in component:
+                modules[filename] = module
+            path = os.path.join(directory, module + ".py")
+            # the module is written next to its file, that is only replaced if it changed
+            output = util.temporary_file_for(path, encoding="utf-8")
+            try:
+                with output:
+                    generator = self._generate_module(output, items, deps, modules)
+            except BaseException:
+                os.remove(output.name)
+                raise
+            util.replace_if_changed(output.name, path)
+            for name in generator.names:
+                symbols.setdefault(name, module)
+            log.debug("Module %s has %d symbols from %s", module, len(generator.names), component)
+        init = pkgutil.get_data("ctypeslib", "data/package_init.tpl").decode()
+        init = init.replace("__SYMBOLS__", "".join("    %r: %r,\n" % (str(k), v) for k, v in symbols.items()))
+        util.write_if_changed(os.path.join(directory, "__init__.py"), init)
+        return module_names
+
+    def _generate_module(self, output, items, deps, modules):
+        """Writes the module of items in output, importing its dependencies deps from their modules"""
+        generator = Generator(output, cfg=self.cfg)
+        generator.library_index = self.library_index
+        generator.generate_headers(self.parser)
+        imports = collections.OrderedDict()
+        for dep in deps:
+            # mark the foreign dependency as already generated, and import it
+            generator.done[dep] = True
+            names = imports.setdefault(modules[dep.location[0]], [])
+            names.append(dep.name)
+            if typedesc.is_record(dep):
+                generator.head_generated.add(dep.name)
+                generator.body_generated.add(dep.name)
+            elif isinstance(dep, typedesc.Enumeration):
+                names.append("%s__enumvalues" % dep.name)
+        for other, names in imports.items():
+            print("from .%s import %s" % (other, ", ".join(names)), file=generator.imports)
+        generator.generate_code(items)
+        return generator
+
 
 # easy to use API.
 
-def translate(input_io, outfile=None, cfg=None):
+def _compile_code(translator, filename="<ctypeslib>", optimize=-1):
+    """Generate the python code in a temporary file, and compile it"""
+    with tempfile.TemporaryFile(mode="w+", encoding="utf-8") as output:
+        translator.generate_code(output)
+        output.seek(0)
+        source = output.read()
+    return compile(source, filename, "exec", optimize=optimize)
+
+
+def _exec_code(translator):
+    """Generate the python code and execute it in a new namespace"""
+    # inject generated code in python namespace
+    namespace = {}
+    exec(_compile_code(translator), namespace)
+    return util.ADict(namespace)
+
+
+def compile_output(path, optimize=-1, sourceless=False):
     """
-        Take a readable C like input readable and translate it to python.
+    Compile a generated module, or all the modules of a generated package, to bytecode,
+    so that importing them never compiles the python code.
+
+    The .pyc files are written in __pycache__, and validated against a hash of the source,
+    so they stay valid when the files are copied or installed.
+    If sourceless, a .pyc is written next to each module instead, to be shipped without the sources.
     """
-    cfg = cfg or config.CodegenConfig()
+    if sourceless:
+        invalidation_mode = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    else:
+        invalidation_mode = py_compile.PycInvalidationMode.CHECKED_HASH
+    if os.path.isdir(path):
+        return compileall.compile_dir(path, quiet=1, legacy=sourceless, optimize=optimize,
+                                      invalidation_mode=invalidation_mode)
+    cfile = os.path.splitext(path)[0] + ".pyc" if sourceless else None
+    py_compile.compile(path, cfile=cfile, doraise=True, optimize=optimize, invalidation_mode=invalidation_mode)
+    return True
+
+
+def compiled_files(sources, optimize=-1, sourceless=False):
+    """Returns the .pyc files compile_output writes for the generated modules sources"""
+    if sourceless:
+        return [os.path.splitext(source)[0] + ".pyc" for source in sources]
+    optimization = None if optimize < 0 else (optimize or "")
+    return [importlib.util.cache_from_source(source, optimization=optimization) for source in sources]
+
+
+def _parse_string(input_io, cfg, unsaved_files=None):
     translator = CodeTranslator(cfg)
     translator.preload_dlls()
-    translator.parse_input_string(input_io)
+    translator.parse_input_string(input_io, unsaved_files)
+    if cfg.symbol_index:
+        translator.write_symbol_index(cfg.symbol_index)
+    return translator
+
+
+def translate(input_io, outfile=None, cfg=None, unsaved_files=None):
+    """
+        Take a readable C like input readable and translate it to python.
+
+        unsaved_files: headers held in memory that the input includes, {filename: contents}
+    """
+    cfg = cfg or config.CodegenConfig()
+    translator = _parse_string(input_io, cfg, unsaved_files)
     # gen python code
     if outfile:
         return translator.generate_code(outfile)
     # otherwise return python
-    output = io.StringIO()
-    translator.generate_code(output)
-    output.seek(0)
-    # inject generated code in python namespace
-    ignore_coding = output.readline()
-    # exec ofi.getvalue() in namespace
-    output = ''.join(output.readlines())
-    namespace = {}
-    exec(output, namespace)
-    return util.ADict(namespace)
+    return _exec_code(translator)
 
 
-def translate_files(source_files, outfile=None, cfg: config.CodegenConfig=None):
+def translate_to_code(input_io, cfg=None, filename="<ctypeslib>", optimize=-1, unsaved_files=None):
     """
-    Translate the content of source_files in python code in outfile
-
-    source_files: list of filenames or single filename
+        Take a readable C like input readable and translate it to a python code object,
+        that can be executed, or marshalled to be loaded later without compilation.
     """
     cfg = cfg or config.CodegenConfig()
+    return _compile_code(_parse_string(input_io, cfg, unsaved_files), filename, optimize)
+
+
+def parse_files(source_files, cfg, index=None, unsaved_files=None):
+    """
+    Returns a CodeTranslator that parsed source_files, ready to generate code
+    index: a clang Index to reuse, when parsing many inputs in the same process
+    unsaved_files: files held in memory, {filename: contents}, read instead of the files on disk
+    """
     translator = CodeTranslator(cfg)
+    translator.index = index
     translator.preload_dlls()
     if isinstance(source_files, list):
-        translator.parse_input_files(source_files)
+        translator.parse_input_files(source_files, unsaved_files)
     else:
-        translator.parse_input_file(source_files)
+        translator.parse_input_file(source_files, unsaved_files)
     log.debug("Input was parsed")
+    if cfg.symbol_index:
+        translator.write_symbol_index(cfg.symbol_index)
+    return translator
+
+
+def translate_files(source_files, outfile=None, cfg: config.CodegenConfig=None, unsaved_files=None):
+    """
+    Translate the content of source_files in python code in outfile
+
+    source_files: list of filenames or single filename
+    unsaved_files: files held in memory, {filename: contents}, that need not exist on disk
+    """
+    cfg = cfg or config.CodegenConfig()
+    translator = parse_files(source_files, cfg, unsaved_files=unsaved_files)
     if outfile:
         return translator.generate_code(outfile)
     # otherwise return python
-    output = io.StringIO()
-    translator.generate_code(output)
-    output.seek(0)
-    # inject generated code in python namespace
-    ignore_coding = output.readline()
-    # exec ofi.getvalue() in namespace
-    output = ''.join(output.readlines())
-    namespace = {}
-    exec(output, namespace)
-    return util.ADict(namespace)
+    return _exec_code(translator)
+
+
+def translate_files_to_code(source_files, cfg: config.CodegenConfig=None, filename="<ctypeslib>", optimize=-1,
+                            unsaved_files=None):
+    """
+    Translate the content of source_files in a python code object
+
+    source_files: list of filenames or single filename
+    unsaved_files: files held in memory, {filename: contents}, that need not exist on disk
+    """
+    cfg = cfg or config.CodegenConfig()
+    return _compile_code(parse_files(source_files, cfg, unsaved_files=unsaved_files), filename, optimize)
+
 
+def translate_files_to_package(source_files, directory, cfg: config.CodegenConfig=None, unsaved_files=None):
+    """
+    Translate the content of source_files in a python package in directory.
+    Each source file is translated in a submodule that is only imported when one
+    of its symbols is first accessed.
+
+    source_files: list of filenames or single filename
+    unsaved_files: files held in memory, {filename: contents}, that need not exist on disk
+    Returns the names of the submodules.
+    """
+    cfg = cfg or config.CodegenConfig()
+    translator = parse_files(source_files, cfg, unsaved_files=unsaved_files)
+    return translator.generate_package(directory)
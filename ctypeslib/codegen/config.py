@@ -6,7 +6,7 @@ import re
 import subprocess
 import sys
 
-from ctypeslib.library import Library
+from ctypeslib.library import Library, SymbolCache, background_pool, shared_library
 from ctypeslib.codegen import typedesc
 
 
@@ -37,6 +37,25 @@ class CodegenConfig:
     searched_dlls: list = []
     # clang preprocessor options
     clang_opts: list = []
+    # only generate what is reachable from functions, variables and requested symbols
+    prune_unreachable: bool = False
+    # bind foreign functions on first access instead of at import time
+    lazy_functions: bool = False
+    # load shared libraries on first use instead of at import time
+    lazy_libraries: bool = False
+    # declare records from compact tables instead of one class statement each:
+    # a smaller .pyc, but a slightly slower import
+    record_tables: bool = False
+    # name the pointer, array and function types written often enough once, at module level
+    hoist_types: bool = False
+    # filename of a SQLite index of all parsed type descriptions
+    symbol_index: str = None
+    # directory of the cache of the symbols exported by libraries
+    symbol_cache: str = None
+    # extract the library symbols in a process pool while the input is parsed
+    background_symbols: bool = False
+    # keep the translation units, to reparse them when an input file changes
+    incremental: bool = False
 
     def __init__(self):
         self._init_types()
@@ -59,8 +78,23 @@ class CodegenConfig:
         self.generate_locations = options.generate_locations
         self.filter_location = not options.generate_includes
         self.preloaded_dlls = options.preload
-        # List exported symbols from libraries
-        self.searched_dlls = [Library(name, nm=options.nm) for name in options.dll]
+        self.symbol_index = options.symbol_index
+        self.prune_unreachable = options.prune_unreachable
+        self.lazy_functions = options.lazy_functions
+        self.lazy_libraries = options.lazy_libraries
+        self.record_tables = options.record_tables
+        self.hoist_types = options.hoist_types
+        self.symbol_cache = options.symbol_cache
+        self.background_symbols = options.background_symbols
+        self.incremental = options.watch
+        # List exported symbols from libraries, on first lookup or in the background, once for the process
+        cache = SymbolCache(self.symbol_cache) if self.symbol_cache else None
+        self.searched_dlls = [shared_library(name, nm=options.nm, cache=cache) for name in options.dll]
+        executor = background_pool() if self.background_symbols else None
+        if executor is not None:
+            for library in self.searched_dlls:
+                if isinstance(library, Library):
+                    library.prefetch(executor)
         self._parse_options_clang_opts(options)
         self._parse_options_modules(options)
         self._parse_options_types(options)
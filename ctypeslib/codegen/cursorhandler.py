@@ -148,12 +148,15 @@ class CursorHandler(ClangHandler):
     @log_entity
     def ENUM_DECL(self, cursor):  # noqa
         """Gets the enumeration declaration."""
+        usr = cursor.get_usr()
+        if self.is_registered_usr(usr):
+            return self.get_registered_usr(usr)
         name = self.get_unique_name(cursor)
         if self.is_registered(name):
             return self.get_registered(name)
         align = cursor.type.get_align()
         size = cursor.type.get_size()
-        obj = self.register(name, typedesc.Enumeration(name, size, align))
+        obj = self.register(name, typedesc.Enumeration(name, size, align), usr)
         self.set_location(obj, cursor)
         self.set_comment(obj, cursor)
         # parse all children
@@ -165,6 +168,9 @@ class CursorHandler(ClangHandler):
     def FUNCTION_DECL(self, cursor):  # noqa
         """Handles function declaration"""
         # FIXME to UT
+        usr = cursor.get_usr()
+        if self.is_registered_usr(usr):
+            return self.get_registered_usr(usr)
         name = self.get_unique_name(cursor)
         if self.is_registered(name):
             return self.get_registered(name)
@@ -178,7 +184,7 @@ class CursorHandler(ClangHandler):
             #    code.interact(local=locals())
             obj.add_argument(arg_obj)
         # code.interact(local=locals())
-        self.register(name, obj)
+        self.register(name, obj, usr)
         self.set_location(obj, cursor)
         self.set_comment(obj, cursor)
         return obj
@@ -214,6 +220,10 @@ class CursorHandler(ClangHandler):
         Gets Type from cache if we known it. Add it to cache otherwise.
         # typedef of an enum
         """
+        # a redeclaration of a known typedef, from any translation unit
+        usr = cursor.get_usr()
+        if self.is_registered_usr(usr):
+            return self.get_registered_usr(usr)
         name = self.get_unique_name(cursor)
         # if the typedef is known, get it from cache
         if self.is_registered(name):
@@ -235,7 +245,7 @@ class CursorHandler(ClangHandler):
                 'Bad TYPEREF parsing in TYPEDEF_DECL: %s' %
                 _type.spelling)
         # register the type
-        obj = self.register(name, typedesc.Typedef(name, p_type))
+        obj = self.register(name, typedesc.Typedef(name, p_type), usr)
         self.set_location(obj, cursor)
         self.set_comment(obj, cursor)
         return obj
@@ -243,6 +253,9 @@ class CursorHandler(ClangHandler):
     @log_entity
     def VAR_DECL(self, cursor):  # noqa
         """Handles Variable declaration."""
+        usr = cursor.get_usr()
+        if self.is_registered_usr(usr):
+            return self.get_registered_usr(usr)
         # get the name
         name = self.get_unique_name(cursor)
         log.debug('VAR_DECL: name: %s', name)
@@ -257,10 +270,10 @@ class CursorHandler(ClangHandler):
         log.debug('VAR_DECL: _type:%s', _type.name)
         log.debug('VAR_DECL: _init:%s', init_value)
         log.debug('VAR_DECL: location:%s', getattr(cursor, 'location'))
-        obj = self.register(name, typedesc.Variable(name, _type, init_value, extern))
+        obj = self.register(name, typedesc.Variable(name, _type, init_value, extern), usr)
         self.set_location(obj, cursor)
         self.set_comment(obj, cursor)
-        return True
+        return obj
 
     def _VAR_DECL_type(self, cursor):  # noqa
         """Generates a typedesc object from a Variable declaration."""
@@ -630,6 +643,11 @@ class CursorHandler(ClangHandler):
         Handles record type declaration.
         Structure, Union...
         """
+        # Find if a record definition was already parsed, in any translation unit
+        usr = cursor.get_usr()
+        if (self.is_registered_usr(usr) and
+                self.get_registered_usr(usr).members is not None):
+            return self.get_registered_usr(usr)
         name = self.get_unique_name(cursor)
         # FIXME, handling anonymous field by adding a child id.
         if num is not None:
@@ -658,7 +676,7 @@ class CursorHandler(ClangHandler):
             obj = _output_type(name, align, None, bases, size, packed=False)
             self.set_location(obj, cursor)
             self.set_comment(obj, cursor)
-            return self.register(name, obj)
+            return self.register(name, obj, usr)
 
         elif size < 0 or align < 0:
             # CXTypeLayoutError_Invalid = -1,
@@ -680,16 +698,21 @@ class CursorHandler(ClangHandler):
         obj = None
         if not self.is_registered(name):
             if not cursor.is_definition():
+                # the definition may be in a file that is not parsed, i.e. filtered out
+                definition = cursor.get_definition()
+                if definition is not None:
+                    log.debug('cursor %s is not on a definition, parsing the definition', name)
+                    return self.parse_cursor(definition)
                 # just save the spot, don't look at members == None
                 log.debug('cursor %s is not on a definition', name)
                 obj = _output_type(name, align, None, bases, size, packed=False)
-                return self.register(name, obj)
+                return self.register(name, obj, usr)
             else:
                 log.debug('cursor %s is a definition', name)
                 # save the type in the registry. Useful for not looping in case of
                 # members with forward references
                 obj = _output_type(name, align, None, bases, size, packed=False)
-                self.register(name, obj)
+                self.register(name, obj, usr)
                 self.set_location(obj, cursor)
                 self.set_comment(obj, cursor)
                 declared_instance = True
@@ -1163,7 +1186,7 @@ class CursorHandler(ClangHandler):
         except DuplicateDefinitionException:
             log.info('Redefinition of %s %s->%s', name, self.parser.all[name].args, value)
             # HACK
-            self.parser.all[name] = obj
+            self.parser.replace_registered(name, obj)
         self.set_location(obj, cursor)
         # set the comment in the obj
         obj.comment = comment
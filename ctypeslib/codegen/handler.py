@@ -48,8 +48,8 @@ class ClangHandler(object):
         self.parser = parser
         self._unhandled = []
 
-    def register(self, name, obj):
-        return self.parser.register(name, obj)
+    def register(self, name, obj, usr=None):
+        return self.parser.register(name, obj, usr)
 
     def get_registered(self, name):
         return self.parser.get_registered(name)
@@ -57,6 +57,12 @@ class ClangHandler(object):
     def is_registered(self, name):
         return self.parser.is_registered(name)
 
+    def get_registered_usr(self, usr):
+        return self.parser.get_registered_usr(usr)
+
+    def is_registered_usr(self, usr):
+        return self.parser.is_registered_usr(usr)
+
     def remove_registered(self, name):
         return self.parser.remove_registered(name)
 
@@ -0,0 +1,230 @@
+"""
+symbolindex - a SQLite index of the type descriptions found by the parser.
+
+The index can be queried to find what a large set of headers declares,
+without generating or importing the python code.
+"""
+
+import logging
+import os
+import sqlite3
+
+from ctypeslib.codegen import typedesc
+
+log = logging.getLogger("symbolindex")
+
+_SCHEMA = """
+CREATE TABLE symbols (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file TEXT,
+    line INTEGER,
+    size INTEGER,
+    align INTEGER,
+    type TEXT
+);
+CREATE TABLE fields (
+    symbol_id INTEGER NOT NULL REFERENCES symbols(id),
+    position INTEGER NOT NULL,
+    name TEXT,
+    type TEXT,
+    offset INTEGER,
+    bits INTEGER
+);
+CREATE TABLE arguments (
+    symbol_id INTEGER NOT NULL REFERENCES symbols(id),
+    position INTEGER NOT NULL,
+    name TEXT,
+    type TEXT,
+    base TEXT
+);
+CREATE TABLE dependencies (
+    symbol_id INTEGER NOT NULL REFERENCES symbols(id),
+    depends TEXT NOT NULL
+);
+CREATE INDEX symbols_name ON symbols(name);
+CREATE INDEX symbols_kind ON symbols(kind);
+CREATE INDEX fields_name ON fields(name);
+CREATE INDEX arguments_type ON arguments(type);
+CREATE INDEX arguments_base ON arguments(base);
+CREATE INDEX dependencies_depends ON dependencies(depends);
+"""
+
+
+def type_spelling(t):
+    """Returns a C-like spelling of a type description"""
+    if isinstance(t, typedesc.PointerType):
+        return "%s *" % type_spelling(t.typ)
+    if isinstance(t, typedesc.ArrayType):
+        return "%s[%s]" % (type_spelling(t.typ), t.size)
+    if isinstance(t, typedesc.CvQualifiedType):
+        return type_spelling(t.typ)
+    if isinstance(t, typedesc.FunctionType):
+        args = ", ".join(type_spelling(a) for a in t.iterArgTypes())
+        return "%s (*)(%s)" % (type_spelling(t.returns), args)
+    if t is None:
+        return None
+    return t.name
+
+
+def base_type_name(t):
+    """Returns the name of a type description, without pointers, arrays and qualifiers"""
+    while isinstance(t, (typedesc.PointerType, typedesc.ArrayType, typedesc.CvQualifiedType)):
+        t = t.typ
+    return t.name
+
+
+def type_dependencies(t):
+    """Returns the names of the declared types a type description refers to"""
+    if isinstance(t, (typedesc.PointerType, typedesc.ArrayType, typedesc.CvQualifiedType)):
+        return type_dependencies(t.typ)
+    if isinstance(t, typedesc.FunctionType):
+        names = type_dependencies(t.returns)
+        for a in t.iterArgTypes():
+            names.extend(type_dependencies(a))
+        return names
+    if isinstance(t, (typedesc.Structure, typedesc.Union, typedesc.Typedef, typedesc.Enumeration)):
+        return [t.name]
+    return []
+
+
+def _with_enum_values(items):
+    """Yields the items, and the constants of each enumeration after it, once"""
+    seen = set()
+    for item in items:
+        values = item.values if isinstance(item, typedesc.Enumeration) else ()
+        for i in [item] + list(values):
+            if id(i) not in seen:
+                seen.add(id(i))
+                yield i
+
+
+class SymbolIndex:
+    """A SQLite database of type descriptions"""
+
+    interesting = (
+        typedesc.Typedef,
+        typedesc.Enumeration,
+        typedesc.EnumValue,
+        typedesc.Function,
+        typedesc.Structure,
+        typedesc.Union,
+        typedesc.Variable,
+        typedesc.Macro,
+        typedesc.Alias,
+    )
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, ecx_tb):
+        self.close()
+        return False
+
+    @classmethod
+    def create(cls, filename, items):
+        """Writes a new index of the items in filename, replacing any previous index"""
+        if os.path.exists(filename):
+            os.remove(filename)
+        index = cls(filename)
+        with index.connection:
+            index.connection.executescript(_SCHEMA)
+            count = index.add_items(items)
+        log.info("Indexed %d symbols in %s", count, filename)
+        return index
+
+    def add_items(self, items):
+        symbols = []
+        fields = []
+        arguments = []
+        dependencies = []
+        for item in _with_enum_values(items):
+            if not isinstance(item, self.interesting) or not item.name:
+                continue
+            symbol_id = len(symbols) + 1
+            location = item.location or (None, None)
+            if isinstance(item, typedesc.EnumValue):
+                # the constants are declared where their enumeration is
+                location = item.enumeration.location or location
+            deps = []
+            _type = None
+            if isinstance(item, (typedesc.Typedef, typedesc.Variable)):
+                _type = type_spelling(item.typ)
+                deps.extend(type_dependencies(item.typ))
+            elif isinstance(item, typedesc.Function):
+                _type = type_spelling(item.returns)
+                deps.extend(type_dependencies(item.returns))
+                for i, arg in enumerate(item.arguments):
+                    arguments.append((symbol_id, i, arg.name, type_spelling(arg.typ), base_type_name(arg.typ)))
+                    deps.extend(type_dependencies(arg.typ))
+            elif isinstance(item, typedesc.EnumValue):
+                _type = item.enumeration.name
+                deps.append(item.enumeration.name)
+            elif isinstance(item, typedesc.Macro):
+                _type = str(item.body) if item.args is None else "%s %s" % (item.args, item.body)
+            elif isinstance(item, typedesc.Alias):
+                _type = item.alias
+            elif typedesc.is_record(item):
+                for base in item.bases:
+                    deps.append(base.name)
+                for i, field in enumerate(item.members or []):
+                    if not isinstance(field, typedesc.Field):
+                        continue
+                    fields.append((symbol_id, i, field.name, type_spelling(field.type), field.offset, field.bits))
+                    deps.extend(type_dependencies(field.type))
+            symbols.append((symbol_id, item.name, type(item).__name__, location[0], location[1],
+                            getattr(item, "size", None), getattr(item, "align", None), _type))
+            dependencies.extend((symbol_id, d) for d in dict.fromkeys(deps) if d != item.name)
+        self.connection.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?, ?)", symbols)
+        self.connection.executemany("INSERT INTO fields VALUES (?, ?, ?, ?, ?, ?)", fields)
+        self.connection.executemany("INSERT INTO arguments VALUES (?, ?, ?, ?, ?)", arguments)
+        self.connection.executemany("INSERT INTO dependencies VALUES (?, ?)", dependencies)
+        return len(symbols)
+
+    _columns = "s.name, s.kind, s.file, s.line, s.size, s.align, s.type"
+
+    def _select(self, where, args):
+        sql = "SELECT DISTINCT %s FROM symbols s %s ORDER BY s.id" % (self._columns, where)
+        return self.connection.execute(sql, args).fetchall()
+
+    def lookup(self, name, kind=None):
+        """Returns the symbols named name, optionally of a typedesc kind"""
+        if kind is None:
+            return self._select("WHERE s.name = ?", (name,))
+        return self._select("WHERE s.name = ? AND s.kind = ?", (name, kind))
+
+    def with_field(self, field_name):
+        """Returns the records that define a field named field_name"""
+        return self._select("JOIN fields f ON f.symbol_id = s.id WHERE f.name = ?", (field_name,))
+
+    def taking(self, type_name):
+        """Returns the functions that take an argument of type type_name, or a pointer or array of it"""
+        return self._select("JOIN arguments a ON a.symbol_id = s.id WHERE a.type = ? OR a.base = ?",
+                            (type_name, type_name))
+
+    def users(self, type_name):
+        """Returns the symbols that depend on type_name"""
+        return self._select("JOIN dependencies d ON d.symbol_id = s.id WHERE d.depends = ?", (type_name,))
+
+    def fields(self, name):
+        """Returns the fields of the record name"""
+        sql = ("SELECT f.name, f.type, f.offset, f.bits FROM fields f JOIN symbols s ON f.symbol_id = s.id "
+               "WHERE s.name = ? ORDER BY f.position")
+        return self.connection.execute(sql, (name,)).fetchall()
+
+    def arguments(self, name):
+        """Returns the arguments of the function name"""
+        sql = ("SELECT a.name, a.type FROM arguments a JOIN symbols s ON a.symbol_id = s.id "
+               "WHERE s.name = ? ORDER BY a.position")
+        return self.connection.execute(sql, (name,)).fetchall()
+
+
+__all__ = ["SymbolIndex"]
@@ -286,4 +286,15 @@ class UndefinedIdentifier(T):
 
 
 def is_record(t):
-    return isinstance(t, Structure) or isinstance(t, Union)
\ No newline at end of file
+    return isinstance(t, Structure) or isinstance(t, Union)
+
+
+def dependencies(t):
+    """Returns the type descriptions directly referred to by t"""
+    deps = [getattr(t, attr, None) for attr in ("typ", "returns", "type", "enumeration")]
+    if isinstance(t, _HasArgs):
+        deps.extend(t.arguments)
+    elif is_record(t):
+        deps.extend(t.bases)
+        deps.extend(t.members or [])
+    return [d for d in deps if isinstance(d, T)]
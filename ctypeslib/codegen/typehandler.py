@@ -76,6 +76,9 @@ class TypeHandler(ClangHandler):
         Handles TYPEDEF statement.
         """
         _decl = _cursor_type.get_declaration()
+        usr = _decl.get_usr()
+        if self.is_registered_usr(usr):
+            return self.get_registered_usr(usr)
         name = self.get_unique_name(_decl)
         if self.is_registered(name):
             obj = self.get_registered(name)
@@ -249,6 +252,9 @@ class TypeHandler(ClangHandler):
         _decl = _cursor_type.get_declaration()  # is a record
         # code.interact(local=locals())
         #_decl_cursor = list(_decl.get_children())[0] # record -> decl
+        usr = _decl.get_usr()
+        if self.is_registered_usr(usr):
+            return self.get_registered_usr(usr)
         name = self.get_unique_name(_decl)  # _cursor)
         if self.is_registered(name):
             obj = self.get_registered(name)
@@ -6,15 +6,23 @@ from clang.cindex import Cursor
 from clang.cindex import TranslationUnit
 from collections.abc import Iterable
 
+import hashlib
 import logging
+import os
 import re
+import stat
+import tempfile
 
 from ctypeslib.codegen import typedesc
 
 log = logging.getLogger('utils')
 
+# the umask of the process, read once: setting it to read it races with the other threads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
-def get_tu(source, lang='c', all_warnings=False, flags=None):
+
+def get_tu(source, lang='c', all_warnings=False, flags=None, unsaved_files=None):
     """Obtain a translation unit from source and language.
 
     By default, the translation unit is created from source file "t.<ext>"
@@ -24,6 +32,9 @@ def get_tu(source, lang='c', all_warnings=False, flags=None):
     Supported languages are {c, cpp, objc}.
 
     all_warnings is a convenience argument to enable all compiler warnings.
+
+    unsaved_files are other files held in memory, as (absolute filename, contents)
+    pairs. The source is then named in the current directory, to include them.
     """
     args = list(flags or [])
     name = 'memory_input.c'
@@ -38,7 +49,11 @@ def get_tu(source, lang='c', all_warnings=False, flags=None):
     if all_warnings:
         args += ['-Wall', '-Wextra']
 
-    return TranslationUnit.from_source(name, args, unsaved_files=[(name, source)])
+    unsaved_files = list(unsaved_files or [])
+    if unsaved_files:
+        # clang finds the included files in memory by their absolute name only
+        name = os.path.abspath(name)
+    return TranslationUnit.from_source(name, args, unsaved_files=[(name, source)] + unsaved_files)
 
 
 def get_cursor(source, spelling):
@@ -129,7 +144,12 @@ class ADict(dict):
         try:
             return self[name]
         except KeyError:
-            raise AttributeError(name)
+            pass
+        # a module level __getattr__ in the generated code, i.e. for lazy functions
+        if '__getattr__' in self:
+            value = self[name] = self['__getattr__'](name)
+            return value
+        raise AttributeError(name)
 
 
 _c_literal_regex = re.compile(
@@ -137,6 +157,50 @@ _c_literal_regex = re.compile(
 )
 
 
+def file_hash(filename):
+    """Returns the sha256 hex digest of the content of filename"""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def replace_if_changed(temporary, filename):
+    """
+    Atomically replaces filename with the temporary file, if their contents differ,
+    otherwise removes the temporary file. Returns True if filename was replaced.
+    """
+    if (os.path.exists(filename) and os.path.getsize(filename) == os.path.getsize(temporary)
+            and file_hash(filename) == file_hash(temporary)):
+        os.remove(temporary)
+        log.debug("%s is unchanged", filename)
+        return False
+    try:
+        mode = stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    # temporary files are only readable by their owner
+    os.chmod(temporary, mode)
+    os.replace(temporary, filename)
+    return True
+
+
+def temporary_file_for(filename, mode="w", encoding=None):
+    """Returns a new temporary file, next to filename, to replace it"""
+    directory = os.path.dirname(os.path.abspath(filename))
+    # pylint: disable-next=consider-using-with
+    return tempfile.NamedTemporaryFile(mode, encoding=encoding, dir=directory,
+                                       prefix=".%s." % os.path.basename(filename), delete=False)
+
+
+def write_if_changed(filename, text):
+    """Writes text to filename, only if its content changed. Returns True if filename was written"""
+    with temporary_file_for(filename, encoding="utf-8") as f:
+        f.write(text)
+    return replace_if_changed(f.name, filename)
+
+
 def from_c_float_literal(value):
     if (not isinstance(value, str) and
             isinstance(value, Iterable) and
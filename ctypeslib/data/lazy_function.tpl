@@ -0,0 +1,14 @@
+
+def __getattr__(name):
+    """Binds and configures a foreign function on first access"""
+    try:
+        library, restype, argtypes, doc = _lazy_functions[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    function = getattr(library, name)
+    function.restype = restype
+    function.argtypes = argtypes
+    if doc is not None:
+        function.__doc__ = doc
+    globals()[name] = function
+    return function
@@ -0,0 +1,52 @@
+import threading
+
+
+class LazyLibrary:
+    """A shared library that is only loaded on first use"""
+    # libraries loaded with RTLD_GLOBAL before the first library of this module
+    _preloads = []
+    _preloaded = False
+    _lock = threading.Lock()
+
+    def __init__(self, loader, path, **kwargs):
+        self._loader = loader
+        self._path = path
+        self._kwargs = kwargs
+        self._library = None
+
+    @staticmethod
+    def _load_preloads():
+        # with the lock held
+        if not LazyLibrary._preloaded:
+            for path in LazyLibrary._preloads:
+                ctypes.CDLL(path, ctypes.RTLD_GLOBAL)
+            LazyLibrary._preloaded = True
+
+    @staticmethod
+    def preload():
+        """Loads the libraries to preload now, instead of before the first library"""
+        with LazyLibrary._lock:
+            LazyLibrary._load_preloads()
+
+    def _load(self):
+        with LazyLibrary._lock:
+            if self._library is None:
+                LazyLibrary._load_preloads()
+                self._library = self._loader(self._path, **self._kwargs)
+        return self._library
+
+    def __getattr__(self, name):
+        library = self._library
+        if library is None:
+            library = self._load()
+        return getattr(library, name)
+
+    def __getitem__(self, name):
+        library = self._library
+        if library is None:
+            library = self._load()
+        return library[name]
+
+    def __repr__(self):
+        return f"<LazyLibrary {self._path!r} loaded:{self._library is not None}>"
+
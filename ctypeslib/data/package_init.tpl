@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+#
+# Submodules are only imported when one of their symbols is first accessed.
+#
+import importlib
+
+_symbols = {
+__SYMBOLS__}
+
+__all__ = sorted(_symbols)
+
+
+def __getattr__(name):
+    try:
+        submodule = _symbols[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module("." + submodule, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return __all__
@@ -0,0 +1,37 @@
+class _RecordTypes(dict):
+    """Resolves and caches the types of a record table against a module namespace"""
+
+    def __init__(self, namespace):
+        super().__init__()
+        self.namespace = namespace
+        self[None] = None
+
+    def __missing__(self, spec):
+        # a type is a name, ('*', type, length) or (callable, type, ...)
+        if isinstance(spec, str):
+            module, _, name = spec.rpartition(".")
+            value = getattr(self.namespace[module], name) if module else self.namespace[name]
+        elif spec[0] == "*":
+            value = self[spec[1]] * spec[2]
+        else:
+            value = self[spec[0]](*[self[arg] for arg in spec[1:]])
+        self[spec] = value
+        return value
+
+
+def _make_records(namespace, table):
+    """Declares and defines records from a table of (name, bases) and (name, fields, anonymous) rows"""
+    types = _RecordTypes(namespace)
+    for row in table:
+        if len(row) == 2:
+            name, bases = row
+            bases = tuple(namespace[base] for base in bases)
+            namespace[name] = type(bases[0])(name, bases, {})
+            continue
+        name, fields, anonymous = row
+        record = namespace[name]
+        record._pack_ = 1
+        if anonymous:
+            record._anonymous_ = anonymous
+        record._fields_ = [(field[0], types[field[1]]) + field[2:] for field in fields]
+
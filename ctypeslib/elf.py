@@ -0,0 +1,166 @@
+"""
+elf - read the dynamic symbols exported by an ELF shared library.
+
+This reads the .dynsym and .dynstr sections, and the GNU symbol version tables,
+directly from the mmap'ed file, and classifies symbols as `nm --dynamic --defined-only` does.
+"""
+
+import mmap
+import struct
+
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERSYM = 0x6fffffff
+
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+SHN_XINDEX = 0xffff
+
+STB_GLOBAL = 1
+STT_GNU_IFUNC = 10
+
+VERSYM_HIDDEN = 0x8000
+VERSYM_VERSION = 0x7fff
+
+
+class ELFError(ValueError):
+    """The file is not an ELF file, or cannot be read as one"""
+
+
+class _Format:
+    """The layout of ELF structures, for a class (32/64 bits) and a byte order"""
+
+    def __init__(self, elf_class, byte_order):
+        if elf_class == 1:
+            self.header = struct.Struct(byte_order + "HHIIIIIHHHHHH")
+            self.section = struct.Struct(byte_order + "IIIIIIIIII")
+            self.symbol = struct.Struct(byte_order + "IIIBBH")
+            self.address = "%08x"
+        else:
+            self.header = struct.Struct(byte_order + "HHIQQQIHHHHHH")
+            self.section = struct.Struct(byte_order + "IIQQQQIIQQ")
+            self.symbol = struct.Struct(byte_order + "IBBHQQ")
+            self.address = "%016x"
+        self.elf_class = elf_class
+        self.half = struct.Struct(byte_order + "H")
+        self.verdef = struct.Struct(byte_order + "HHHHIII")
+        self.verdaux = struct.Struct(byte_order + "II")
+
+    def symbols(self, data):
+        """Yields (name, value, info, shndx) of the symbols of a symbol table"""
+        if self.elf_class == 1:
+            for name, value, _, info, _, shndx in self.symbol.iter_unpack(data):
+                yield name, value, info, shndx
+        else:
+            for name, info, _, shndx, value, _ in self.symbol.iter_unpack(data):
+                yield name, value, info, shndx
+
+
+def _string(table, offset):
+    return table[offset:table.index(b"\0", offset)].decode("utf-8", "surrogateescape")
+
+
+def _sections(view, fmt):
+    # e_shoff, e_shentsize, e_shnum, e_shstrndx
+    header = fmt.header.unpack_from(view, 16)
+    shoff, shentsize, shnum = header[5], header[10], header[11]
+    if shoff == 0:
+        raise ELFError("no section headers")
+    if shnum == 0:
+        # more than SHN_LORESERVE sections, the count is in the first section header
+        shnum = fmt.section.unpack_from(view, shoff)[5]
+    sections = []
+    for i in range(shnum):
+        name, type_, _, _, offset, size, link, info = fmt.section.unpack_from(view, shoff + i * shentsize)[:8]
+        sections.append((name, type_, offset, size, link, info))
+    return sections
+
+
+def _section_data(view, section):
+    return view[section[2]:section[2] + section[3]]
+
+
+def _bss_sections(view, fmt, sections):
+    """Returns, by section index, whether the section is uninitialized data nm lists as B"""
+    shstrndx = fmt.header.unpack_from(view, 16)[12]
+    if shstrndx == SHN_XINDEX:
+        shstrndx = sections[0][4]
+    names = _section_data(view, sections[shstrndx]) if shstrndx < len(sections) else b""
+    # nm lists the small uninitialized data, in .sbss, as S
+    return [s[1] == SHT_NOBITS and not names[s[0]:].startswith(b".sbss") for s in sections]
+
+
+def _version_names(view, fmt, sections, verdef):
+    """Returns the names of the versions defined in a SHT_GNU_verdef section, by index"""
+    _, _, offset, _, link, count = verdef
+    strings = _section_data(view, sections[link])
+    names = {}
+    for _ in range(count):
+        _, flags, index, _, _, aux, next_ = fmt.verdef.unpack_from(view, offset)
+        names[index] = _string(strings, fmt.verdaux.unpack_from(view, offset + aux)[0])
+        if next_ == 0:
+            break
+        offset += next_
+    return names
+
+
+def read_dynamic_symbols(view):
+    """
+    Returns a dict of the defined, global, dynamic symbols of the ELF image in view,
+    to their address as a hex string, as `nm --dynamic --defined-only` would list with
+    the kinds T, D, G, R or S.
+    A symbol of a non default version is named name@version.
+    """
+    if view[:4] != b"\x7fELF":
+        raise ELFError("not an ELF file")
+    if view[4] not in (1, 2) or view[5] not in (1, 2):
+        raise ELFError("unknown ELF class or data encoding")
+    fmt = _Format(view[4], "<" if view[5] == 1 else ">")
+    try:
+        sections = _sections(view, fmt)
+        dynsym = [s for s in sections if s[1] == SHT_DYNSYM]
+        if not dynsym:
+            raise ELFError("no .dynsym section")
+        strings = _section_data(view, sections[dynsym[0][4]])
+        symbols = _section_data(view, dynsym[0])
+        symbols = symbols[:len(symbols) - len(symbols) % fmt.symbol.size]
+        versions = {}
+        versym = None
+        for section in sections:
+            if section[1] == SHT_GNU_VERDEF:
+                versions = _version_names(view, fmt, sections, section)
+            elif section[1] == SHT_GNU_VERSYM:
+                versym = _section_data(view, section)
+        nobits = _bss_sections(view, fmt, sections)
+        result = {}
+        for i, (name, value, info, shndx) in enumerate(fmt.symbols(symbols)):
+            # defined, in a section, global, not an indirect function, not in .bss
+            if name == 0 or shndx == SHN_UNDEF or SHN_LORESERVE <= shndx:
+                continue
+            if info >> 4 != STB_GLOBAL or info & 0xf == STT_GNU_IFUNC or nobits[shndx]:
+                continue
+            name = _string(strings, name)
+            if versym is not None:
+                version = fmt.half.unpack_from(versym, i * 2)[0]
+                if version & VERSYM_HIDDEN and (version & VERSYM_VERSION) in versions:
+                    name = "%s@%s" % (name, versions[version & VERSYM_VERSION])
+            result[name] = fmt.address % value
+        return result
+    except (struct.error, IndexError) as e:
+        raise ELFError("truncated or invalid ELF file: %s" % e) from e
+
+
+def dynamic_symbols(filename):
+    """Returns the exported dynamic symbols of the ELF shared library filename"""
+    with open(filename, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            # an empty file
+            raise ELFError(str(e)) from e
+    with data:
+        return read_dynamic_symbols(data)
+
+
+__all__ = ["ELFError", "dynamic_symbols", "read_dynamic_symbols"]
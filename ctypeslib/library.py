@@ -1,12 +1,20 @@
+import concurrent.futures
+import hashlib
+import marshal
 import os
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
 from ctypes import RTLD_LOCAL, RTLD_GLOBAL
 
+from ctypeslib import elf
+
 
 class LibraryMeta(type):
 
-    def __call__(cls, name, mode=RTLD_LOCAL, nm="nm"):
+    def __call__(cls, name, mode=RTLD_LOCAL, nm="nm", cache=None):
 
         if os.name == "nt":
             from ctypes import WinDLL
@@ -15,7 +23,7 @@ class LibraryMeta(type):
         if os.path.exists(name) and mode != RTLD_GLOBAL and nm is not None:
             # Use 'nm' on Unixes to load native and cross-compiled libraries
             # (this is only possible if mode != RTLD_GLOBAL)
-            return super(LibraryMeta, cls).__call__(name, nm)
+            return super(LibraryMeta, cls).__call__(name, nm, cache)
         from ctypes import CDLL
         from ctypes.util import find_library
         path = find_library(name)
@@ -27,34 +35,245 @@ class LibraryMeta(type):
 
 
 class Library(metaclass=LibraryMeta):
+    """
+    The symbols exported by a shared library file.
+
+    The symbols are extracted on the first lookup, so that a library nothing is looked up in,
+    as with a header that only declares types, is never read. An extraction error is raised
+    on that lookup.
+
+    prefetch() starts the extraction in a process pool instead, and the first lookup waits
+    for it. The extraction is pure Python, so processes overlap it with parsing, where threads
+    would contend for the GIL.
+    """
 
-    def __init__(self, filepath, nm):
+    def __init__(self, filepath, nm, cache=None):
         self._filepath = filepath
         self._name = os.path.basename(self._filepath)
-        self.__symbols = {}
-        self._get_symbols(nm)
+        self._nm = nm
+        self._cache = cache
+        self.__symbols = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def prefetch(self, executor):
+        """Starts extracting the symbols in executor, a concurrent.futures.Executor"""
+        with self._lock:
+            if self.__symbols is None and self._pending is None:
+                self._pending = executor.submit(Library._load_symbols, self._filepath, self._nm, self._cache)
+
+    def _symbols(self):
+        symbols = self.__symbols
+        if symbols is None:
+            with self._lock:
+                if self.__symbols is None:
+                    pending, self._pending = self._pending, None
+                    if pending is not None:
+                        # raises the exception of the extraction, if any
+                        self.__symbols = pending.result()
+                    else:
+                        self.__symbols = self._load_symbols(self._filepath, self._nm, self._cache)
+                symbols = self.__symbols
+        return symbols
+
+    @staticmethod
+    def _load_symbols(filepath, nm, cache):
+        if cache is None:
+            return Library._get_symbols(filepath, nm)
+        symbols = cache.load(filepath, nm)
+        if symbols is None:
+            stat = os.stat(filepath)
+            symbols = Library._get_symbols(filepath, nm)
+            cache.store(filepath, nm, stat, symbols)
+        return symbols
+
+    @staticmethod
+    def _get_symbols(filepath, nm):
+        # ELF libraries are read in process, other formats (Mach-O) are listed by nm
+        try:
+            return elf.dynamic_symbols(filepath)
+        except (elf.ELFError, OSError):
+            pass
+        return Library._get_nm_symbols(filepath, nm)
 
     # nm will print lines like this:
     # <addr> <kind> <name>
-    def _get_symbols(self, nm):
-
+    @staticmethod
+    def _get_nm_symbols(filepath, nm):
+        symbols = {}
         cmd = [nm,]
         if sys.platform != 'darwin':
             # fix for #125, nm error "File format has no dynamic symbol table" for dylib
             cmd.append("--dynamic")
-        cmd.extend(["--defined-only", self._filepath])
+        cmd.extend(["--defined-only", filepath])
         output = subprocess.check_output(cmd, universal_newlines=True)
         for line in output.split('\n'):
             fields = line.split(' ', 2)
             if len(fields) >= 3 and fields[1] in ("T", "D", "G", "R", "S"):
                 if '@@' in fields[2]: fields[2] = fields[2].split('@@')[0]
-                self.__symbols[fields[2]] = fields[0]
+                symbols[fields[2]] = fields[0]
+        return symbols
+
+    def _symbol_names(self):
+        return self._symbols().keys()
 
     def __getattr__(self, name):
+        if name.startswith("__"):
+            # not a symbol, as copy and pickle probing for __getstate__ and such
+            raise AttributeError(name)
         try:
-            return self.__symbols[name]
+            return self._symbols()[name]
         except KeyError:
             pass
         raise AttributeError(name)
 
 
+# the libraries shared by the whole process, by name, nm and symbol cache, see shared_library()
+_shared_libraries = {}
+_shared_libraries_lock = threading.Lock()
+
+
+def shared_library(name, nm="nm", cache=None):
+    """
+    Returns the library name, created once for the whole process, so that its symbols are
+    extracted once for all the translations. A library file that changed is loaded again.
+    """
+    key = (name, nm, None if cache is None else cache.directory)
+    try:
+        stat = os.stat(name)
+        identity = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except OSError:
+        identity = None
+    with _shared_libraries_lock:
+        entry = _shared_libraries.get(key)
+        if entry is None or entry[0] != identity:
+            entry = _shared_libraries[key] = (identity, Library(name, nm=nm, cache=cache))
+    return entry[1]
+
+
+# the process pool extracting symbols in the background, see background_pool()
+_background_pool = None
+
+
+def background_pool():
+    """
+    Returns the process pool, created once for the whole process, that extracts the symbols
+    of the libraries in the background. None on a single CPU, where it could only slow down parsing.
+    """
+    global _background_pool
+    cpus = os.cpu_count() or 1
+    if cpus < 2:
+        return None
+    with _shared_libraries_lock:
+        if _background_pool is None:
+            _background_pool = concurrent.futures.ProcessPoolExecutor(cpus - 1)
+    return _background_pool
+
+
+class SymbolCache:
+    """
+    Persistent cache of the symbols exported by libraries, one file per library in directory.
+
+    An entry is keyed by the real path of the library and the nm program, and is only
+    used while the inode, size and modification time of the library are unchanged.
+    """
+    # magic, format version, inode, size, modification time in ns
+    _header = struct.Struct("<4sHQQq")
+    _magic = b"CTSY"
+    _version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _entry(self, filepath, nm):
+        key = "%s\0%s" % (os.path.realpath(filepath), nm)
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8", "surrogateescape")).hexdigest())
+
+    def _identity(self, stat):
+        return self._magic, self._version, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def load(self, filepath, nm):
+        """Returns the cached symbols of the library filepath, or None if they are missing or stale"""
+        try:
+            with open(self._entry(filepath, nm), "rb") as f:
+                data = f.read()
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        if len(data) < self._header.size or self._header.unpack_from(data) != self._identity(stat):
+            return None
+        try:
+            return marshal.loads(data[self._header.size:])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def store(self, filepath, nm, stat, symbols):
+        """Saves the symbols of the library filepath, as it was when stat was taken"""
+        data = self._header.pack(*self._identity(stat)) + marshal.dumps(symbols)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=self.directory, prefix=".symbols")
+        except OSError:
+            # the cache is an optimization, a read-only directory is not an error
+            return
+        try:
+            with os.fdopen(handle, "wb") as f:
+                f.write(data)
+            os.replace(temporary, self._entry(filepath, nm))
+        except OSError:
+            os.unlink(temporary)
+
+
+class LibraryIndex:
+    """
+    Maps symbol names to the library that exports them, among a list of libraries.
+
+    Precedence follows the order of the list, as with the linker: when several
+    libraries export a symbol, the first one wins. The symbols of all Library
+    objects are merged in one dictionary, on the first lookup. Libraries that cannot
+    list their symbols (ctypes.CDLL, ctypes.WinDLL) are probed with getattr, at their
+    position in the list.
+    """
+
+    def __init__(self, libraries):
+        self.libraries = libraries
+        self._index = None
+        self._opaque = None
+
+    def _build(self):
+        index = {}
+        opaque = []
+        for position, library in enumerate(self.libraries):
+            if isinstance(library, Library):
+                for name in library._symbol_names():
+                    index.setdefault(name, (position, library))
+            else:
+                opaque.append((position, library))
+        self._index = index
+        self._opaque = opaque
+
+    def find(self, name):
+        """Returns the first library exporting name, or None"""
+        if self._index is None:
+            self._build()
+        position, library = self._index.get(name, (len(self.libraries), None))
+        for other_position, other in self._opaque:
+            if other_position > position:
+                break
+            try:
+                getattr(other, name)
+            except AttributeError:
+                continue
+            return other
+        return library
+
+    def find_function(self, func):
+        """Returns the library exporting a Function or Variable type description, or None"""
+        if hasattr(func, "dllname"):
+            return func.dllname
+        name = func.name
+        if os.name == "posix" and sys.platform == "darwin":
+            name = "_%s" % name
+        return self.find(name)
+
+
@@ -19,12 +19,22 @@ __license__ = "GPL"
 __maintainer__ = "Loic Jaquemet"
 __status__ = "Production"
 
+import atexit
+import os
+import shutil
 import sys
+import tempfile
 if sys.version_info < (2, 7):
     import unittest2 as unittest
 else:
     import unittest
 
+# the tests, and the clang2py processes they run, cache in a temporary directory, not in the user's
+_cache_home = tempfile.mkdtemp(prefix='ctypeslib-test-cache')
+atexit.register(shutil.rmtree, _cache_home, True)
+os.environ['XDG_CACHE_HOME'] = _cache_home
+os.environ.pop('CTYPESLIB_LIBCLANG_CACHE', None)
+
 
 def alltests():
     ret = unittest.TestLoader().discover('test/')
@@ -1,8 +1,19 @@
+import ctypes
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
+import unittest.mock
 import io
+import marshal
+import re
 
 import ctypeslib
+from ctypeslib.codegen import codegenerator
 from ctypeslib.codegen import config
 from ctypeslib.codegen import typedesc
 
@@ -57,6 +68,19 @@ struct example {
         self.assertEqual(py_namespace.i, 12)
         self.assertEqual(py_namespace.c2, ['a', 'b', 'c'])
 
+    def test_spooled_output(self):
+        # force the generated body to be spooled on disk
+        with unittest.mock.patch.object(codegenerator.Generator, "spool_max_size", 16):
+            py_namespace = ctypeslib.translate('''
+struct example_detail { int first; int last; };
+int i = 12;''')
+            code = ctypeslib.translate_to_code('struct point { int x; int y; };')
+        self.assertIn("struct_example_detail", py_namespace)
+        self.assertEqual(py_namespace.i, 12)
+        self.assertIn("struct_point", code.co_names)
+        # the spool is created on first use
+        self.assertIsNone(codegenerator.Generator(io.StringIO(), config.CodegenConfig())._stream)
+
     def test_basic_file_io(self):
         py_namespace = ctypeslib.translate_files('test/data/test-library.c')
         self.assertIn("a", py_namespace)
@@ -81,6 +105,195 @@ struct example {
         self.assertIn("myEnum", output)
         self.assertIn("WORD_SIZE is: 4", output)
 
+    def test_package_output(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'base.h'), 'w') as f:
+                f.write("struct base { int x; };\n")
+            with open(os.path.join(tmpdir, 'user.h'), 'w') as f:
+                f.write('#include "base.h"\nstruct user { struct base b; };\nint use(struct user *u);\n')
+            package = os.path.join(tmpdir, 'bindings')
+            modules = codegenerator.translate_files_to_package([os.path.join(tmpdir, 'user.h')], package)
+            self.assertEqual(['base', 'user'], modules)
+            sys.path.insert(0, tmpdir)
+            try:
+                bindings = importlib.import_module('bindings')
+                # submodules are imported on first access
+                self.assertNotIn('bindings.user', sys.modules)
+                self.assertIn('struct_user', dir(bindings))
+                self.assertEqual(4, ctypes.sizeof(bindings.struct_user))
+                self.assertIn('bindings.user', sys.modules)
+                self.assertIs(bindings.struct_base, sys.modules['bindings.base'].struct_base)
+                with self.assertRaises(AttributeError):
+                    bindings.whatever
+            finally:
+                sys.path.remove(tmpdir)
+                for name in [m for m in sys.modules if m.split('.')[0] == 'bindings']:
+                    del sys.modules[name]
+
+    def test_input_files_order(self):
+        headers = {'common.h': 'struct shared { int a; };\nextern int counter;\n',
+                   'a.h': '#include "common.h"\nextern int counter;\nint use_a(struct shared *s);\n',
+                   'b.h': '#include "common.h"\nstruct shared;\nextern int counter;\nint use_b(struct shared *s);\n'}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, text in headers.items():
+                with open(os.path.join(tmpdir, name), 'w') as f:
+                    f.write(text)
+            outputs = []
+            for order in [['a.h', 'b.h'], ['b.h', 'a.h']]:
+                output = io.StringIO()
+                ctypeslib.translate_files([os.path.join(tmpdir, name) for name in order], outfile=output)
+                outputs.append(output.getvalue())
+        # the same declarations are generated, once, whatever the order of the files
+        self.assertEqual(sorted(outputs[0].splitlines()), sorted(outputs[1].splitlines()))
+        for output in outputs:
+            self.assertEqual(1, output.count("struct_shared._fields_ = ["))
+            self.assertEqual(1, output.count("counter = 0"))
+
+    def test_unsaved_files(self):
+        # headers in memory, that include each other, in a directory that does not exist
+        headers = {'virtual/base.h': 'struct base { int x; };\nint unused;\n',
+                   'virtual/user.h': '#include "base.h"\nstruct user { struct base b; long l; };\n'}
+        self.assertFalse(os.path.exists('virtual'))
+        py_namespace = ctypeslib.translate('#include "virtual/user.h"\nint use(struct user *u);',
+                                           unsaved_files=headers)
+        self.assertEqual(16, ctypes.sizeof(py_namespace.struct_user))
+        self.assertIn("use", py_namespace)
+        py_namespace = ctypeslib.translate_files(['virtual/user.h'], unsaved_files=headers)
+        self.assertIn("struct_user", py_namespace)
+        # the declarations of the included file are filtered out
+        self.assertNotIn("unused", py_namespace)
+
+    def test_targets_in_threads(self):
+        # parsers of different targets, that exist at the same time in different threads
+        barrier = threading.Barrier(2)
+        outputs = {}
+
+        def translate(target):
+            cfg = config.CodegenConfig()
+            cfg.clang_opts.extend(['-target', target])
+            translator = codegenerator.CodeTranslator(cfg)
+            translator.preload_dlls()
+            translator.make_clang_parser()
+            barrier.wait()
+            translator.parse_input_files(['virtual/target.h'], {'virtual/target.h': 'struct s { long l; int i; };'})
+            output = io.StringIO()
+            translator.generate_code(output)
+            outputs[target] = output.getvalue()
+
+        threads = [threading.Thread(target=translate, args=(target,))
+                   for target in ('i386-linux-gnu', 'x86_64-linux-gnu')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIn("('l', ctypes.c_int32)", outputs['i386-linux-gnu'])
+        self.assertIn("('l', ctypes.c_int64)", outputs['x86_64-linux-gnu'])
+
+    def test_translate_to_code(self):
+        code = ctypeslib.translate_to_code(io.StringIO('struct point { int x; int y; };'), filename='point.py')
+        self.assertEqual('point.py', code.co_filename)
+        namespace = {}
+        exec(marshal.loads(marshal.dumps(code)), namespace)
+        self.assertEqual(8, ctypes.sizeof(namespace['struct_point']))
+        code = ctypeslib.translate_files_to_code('test/data/test-enum.c')
+        self.assertIn('ZERO', code.co_names)
+
+    def test_lazy_import(self):
+        # a fresh interpreter, ctypeslib is already fully imported here
+        code = ("import sys, ctypeslib, ctypeslib.library\n"
+                "print('clang.cindex' in sys.modules, 'ctypeslib.codegen' in sys.modules)\n"
+                "from ctypeslib import translate\n"
+                "print('clang.cindex' in sys.modules, translate('int i = 3;').i)\n")
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True,
+                                         stderr=subprocess.DEVNULL)
+        self.assertEqual(['False False', 'True 3'], output.splitlines())
+
+    def test_clang_discovery_cache(self):
+        load = getattr(ctypeslib, '__load_discovery_cache')
+        save = getattr(ctypeslib, '__save_discovery_cache')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            library = os.path.join(tmpdir, 'libclang.so')
+            open(library, 'w').close()
+            with unittest.mock.patch.dict(os.environ, {'CTYPESLIB_LIBCLANG_CACHE': os.path.join(tmpdir, 'cache.json')}):
+                self.assertIsNone(load())
+                save(library, '14.0.6')
+                self.assertEqual((library, '14.0.6'), load())
+                # a modified library invalidates the cache
+                os.utime(library, ns=(0, 0))
+                self.assertIsNone(load())
+                save(library, '14.0.6')
+                with unittest.mock.patch.dict(os.environ, {'LD_LIBRARY_PATH': tmpdir}):
+                    self.assertIsNone(load())
+                # nothing found is cached while no library is added to the directories searched
+                libdir = os.path.join(tmpdir, 'lib')
+                os.mkdir(libdir)
+                os.utime(libdir, ns=(0, 0))
+                with unittest.mock.patch.dict(os.environ, {'LD_LIBRARY_PATH': libdir}):
+                    save(None, None)
+                    self.assertEqual((None, None), load())
+                    open(os.path.join(libdir, 'libclang.so'), 'w').close()
+                    self.assertIsNone(load())
+            with unittest.mock.patch.dict(os.environ, {'CTYPESLIB_LIBCLANG_CACHE': ''}):
+                save(library, '14.0.6')
+                self.assertIsNone(load())
+
+    def test_reparse(self):
+        def generate(translator):
+            output = io.StringIO()
+            translator.generator = None
+            translator.generate_code(output)
+            return output.getvalue()
+
+        def edit(filename, old, new):
+            with open(filename) as f:
+                text = f.read()
+            with open(filename, 'w') as f:
+                f.write(text.replace(old, new))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base, user = os.path.join(tmpdir, 'base.h'), os.path.join(tmpdir, 'user.h')
+            with open(base, 'w') as f:
+                f.write("struct later;\nstruct base { int x; };\n")
+            with open(user, 'w') as f:
+                f.write('#include "base.h"\nstruct user { struct base b; struct later *l; };\n'
+                        'struct later { int y; };\nint use(struct user *u);\n')
+            cfg = config.CodegenConfig()
+            cfg.filter_location = False
+            cfg.incremental = True
+            translator = codegenerator.parse_files([user], cfg)
+            generate(translator)
+            for filename, old, new in [(base, 'int x;', 'int x; long z;'),
+                                       (user, 'int y;', 'char y;'),
+                                       (user, 'int use(', 'int added(void);\nint use(')]:
+                edit(filename, old, new)
+                translator.reparse([filename])
+                output = generate(translator)
+                cfg.incremental = False
+                self.assertEqual(generate(codegenerator.parse_files([user], cfg)), output)
+                cfg.incremental = True
+            self.assertIn("('z', ctypes.c_int64)", output)
+            self.assertIn("('y', ctypes.c_char)", output)
+            self.assertIn("added.restype", output)
+
+    def test_compile_output(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'point.py')
+            with open(filename, 'w') as f:
+                ctypeslib.translate('struct point { int x; int y; };', outfile=f)
+            codegenerator.compile_output(filename)
+            cfile = importlib.util.cache_from_source(filename)
+            self.assertTrue(os.path.exists(cfile))
+            codegenerator.compile_output(filename, optimize=2, sourceless=True)
+            os.remove(filename)
+            sys.path.insert(0, tmpdir)
+            try:
+                point = importlib.import_module('point')
+                self.assertEqual(os.path.join(tmpdir, 'point.pyc'), point.__file__)
+                self.assertEqual(8, ctypes.sizeof(point.struct_point))
+            finally:
+                sys.path.remove(tmpdir)
+                del sys.modules['point']
+
 
 class ConfigTest(unittest.TestCase):
     def setUp(self) -> None:
@@ -113,6 +326,62 @@ class ConfigTest(unittest.TestCase):
         self.assertNotIn("struct_example_1", py_namespace)
         self.assertIn("union_example_2", py_namespace)
 
+    def test_filter_symbols_and_expressions(self):
+        cfg = config.CodegenConfig()
+        cfg.symbols = ["struct_example_1", "union_example_2"]
+        cfg.expressions = ["example_1", "^struct_"]
+        translator = codegenerator.CodeTranslator(cfg)
+        translator.parse_input_string(self.input_io)
+        translator.filtered_items = list(translator.items)
+        translator.filter_items()
+        # an item is selected if it is one of the symbols, and matches one of the expressions
+        self.assertEqual(["struct_example_1"], [i.name for i in translator.filtered_items])
+        self.assertEqual(2, translator.filter_stats["symbol"])
+        self.assertEqual(1, translator.filter_stats["regex"])
+        # the filters can still be applied one by one
+        translator.filtered_items = list(translator.items)
+        translator.filter_types()
+        translator.filter_symbols()
+        self.assertEqual(["struct_example_1", "union_example_2"], [i.name for i in translator.filtered_items])
+        translator.filter_expressions()
+        self.assertEqual(["struct_example_1"], [i.name for i in translator.filtered_items])
+
+    def test_filter_expressions_flags(self):
+        cfg = config.CodegenConfig()
+        cfg.expressions = [re.compile("EXAMPLE_2", re.IGNORECASE), re.compile("^struct_")]
+        translator = codegenerator.CodeTranslator(cfg)
+        translator.parse_input_string(self.input_io)
+        translator.filtered_items = list(translator.items)
+        translator.filter_items()
+        # the flags of each compiled expression are kept
+        self.assertEqual(["struct_example_1", "union_example_2"], [i.name for i in translator.filtered_items])
+
+    def test_filter_expressions_backreferences(self):
+        cfg = config.CodegenConfig()
+        cfg.expressions = ["^(.)\\1", "^struct_", "^(.)b\\1"]
+        search = codegenerator.CodeTranslator(cfg)._compile_expressions()
+        # the groups of each expression keep their numbers
+        self.assertTrue(search("aab"))
+        self.assertTrue(search("aba"))
+        self.assertTrue(search("struct_s"))
+        self.assertFalse(search("abc"))
+
+    def test_prune_unreachable(self):
+        cfg = config.CodegenConfig()
+        cfg.prune_unreachable = True
+        py_namespace = ctypeslib.translate('''
+        struct used { int a; };
+        struct nested { struct used u; };
+        struct unused { int b; };
+        typedef int unused_t;
+        int get(struct nested *n);
+        ''', cfg=cfg)
+        self.assertIn("get", py_namespace)
+        self.assertIn("struct_nested", py_namespace)
+        self.assertIn("struct_used", py_namespace)
+        self.assertNotIn("struct_unused", py_namespace)
+        self.assertNotIn("unused_t", py_namespace)
+
 
 if __name__ == '__main__':
     unittest.main()
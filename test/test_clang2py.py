@@ -1,10 +1,20 @@
+import concurrent.futures.process
+import importlib.util
+import json
 import os.path
+import shutil
+import signal
+import socket
+import subprocess
 import sys
 import tempfile
+import time
 import unittest
+import unittest.mock
 
-from test.util import ClangTest, clang2py, run
+from test.util import ClangTest, clang2py, clang2py_path, run
 import ctypeslib
+import ctypeslib.clang2py
 
 
 class InputOutput(ClangTest):
@@ -33,6 +43,278 @@ class InputOutput(ClangTest):
             self.assertIn("WORD_SIZE is:", fileoutput)
             self.assertTrue(os.path.exists(fout.name))
 
+    def test_pyc(self):
+        """run clang2py test/data/test-includes.h -o filename --pyc"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'includes.py')
+            p, output, stderr = clang2py(['test/data/test-includes.h', '-o', filename, '--pyc'])
+            self.assertEqual(0, p.returncode)
+            self.assertTrue(os.path.exists(importlib.util.cache_from_source(filename)))
+            p, output, stderr = clang2py(['test/data/test-includes.h', '-o', filename, '--sourceless'])
+            self.assertEqual(0, p.returncode)
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, 'includes.pyc')))
+
+    def test_preload_lazy_libraries(self):
+        """run clang2py --lazy-libraries --preload libm.so.6 test/data/test-records.c"""
+        p, output, stderr = clang2py(['--lazy-libraries', '--preload', 'libm.so.6', 'test/data/test-records.c'])
+        self.assertEqual(0, p.returncode)
+        namespace = {}
+        exec(output, namespace)
+        # no library of the module loads the preloaded ones, they are loaded on import
+        self.assertEqual(['libm.so.6'], namespace['LazyLibrary']._preloads)
+        self.assertTrue(namespace['LazyLibrary']._preloaded)
+
+    def test_unchanged_output(self):
+        """an output with the same content is not replaced"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'includes.py')
+            p, output, stderr = clang2py(['test/data/test-includes.h', '-o', filename])
+            self.assertEqual(0, p.returncode)
+            os.utime(filename, (0, 0))
+            p, output, stderr = clang2py(['test/data/test-includes.h', '-o', filename])
+            self.assertEqual(0, p.returncode)
+            self.assertEqual(0, os.stat(filename).st_mtime)
+            self.assertEqual(['includes.py'], os.listdir(tmpdir))
+
+    def test_stamp(self):
+        """run clang2py header.h -o filename --stamp stamp twice"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header = os.path.join(tmpdir, 'header.h')
+            with open(os.path.join(tmpdir, 'included.h'), 'w') as f:
+                f.write('struct included { int x; };\n')
+            with open(header, 'w') as f:
+                f.write('#include "included.h"\nstruct header { struct included i; };\n')
+            filename = os.path.join(tmpdir, 'header.py')
+            stamp = os.path.join(tmpdir, 'header.stamp')
+            args = [header, '-o', filename, '--stamp', stamp]
+            p, output, stderr = clang2py(args)
+            self.assertEqual(0, p.returncode)
+            self.assertTrue(os.path.exists(stamp))
+            p, output, stderr = clang2py(args)
+            self.assertIn('is up to date', stderr)
+            # a change in an included file is seen
+            with open(os.path.join(tmpdir, 'included.h'), 'w') as f:
+                f.write('struct included { int x; int y; };\n')
+            p, output, stderr = clang2py(args)
+            self.assertNotIn('is up to date', stderr)
+            with open(filename) as f:
+                self.assertIn("('y', ctypes.c_int32)", f.read())
+
+    def test_stamp_pyc(self):
+        """run clang2py header.h -o filename --pyc --stamp stamp, and remove the .pyc"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header = os.path.join(tmpdir, 'header.h')
+            with open(header, 'w') as f:
+                f.write('struct header { int x; };\n')
+            filename = os.path.join(tmpdir, 'header.py')
+            stamp = os.path.join(tmpdir, 'header.stamp')
+            for option, pyc in [('--pyc', importlib.util.cache_from_source(filename)),
+                                ('--sourceless', os.path.join(tmpdir, 'header.pyc'))]:
+                args = [header, '-o', filename, option, '--stamp', stamp]
+                p, output, stderr = clang2py(args)
+                self.assertEqual(0, p.returncode)
+                p, output, stderr = clang2py(args)
+                self.assertIn('is up to date', stderr)
+                # the bytecode is an output too
+                os.remove(pyc)
+                p, output, stderr = clang2py(args)
+                self.assertNotIn('is up to date', stderr)
+                self.assertTrue(os.path.exists(pyc))
+
+    def test_stamp_libraries_and_package(self):
+        """run clang2py header.h -l library.so --package -o package --stamp stamp twice"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header = os.path.join(tmpdir, 'header.h')
+            with open(os.path.join(tmpdir, 'included.h'), 'w') as f:
+                f.write('struct included { int x; };\n')
+            with open(header, 'w') as f:
+                f.write('#include "included.h"\nstruct header { struct included i; };\n')
+            library = os.path.join(tmpdir, 'library.so')
+            shutil.copy('test/data/test-callbacks.so', library)
+            package = os.path.join(tmpdir, 'package')
+            stamp = os.path.join(tmpdir, 'header.stamp')
+            args = [header, '-l', library, '--package', '-o', package, '--stamp', stamp]
+            p, output, stderr = clang2py(args)
+            self.assertEqual(0, p.returncode)
+            with open(stamp) as f:
+                recorded = json.load(f)
+            # every module of the package, and the library file are recorded
+            self.assertEqual(sorted(os.path.join(package, name) for name in ['__init__.py', 'header.py', 'included.py']),
+                             sorted(recorded['outputs']))
+            self.assertEqual([library], list(recorded['libraries']))
+            p, output, stderr = clang2py(args)
+            self.assertIn('is up to date', stderr)
+            # a changed module is generated again
+            with open(os.path.join(package, 'included.py'), 'a') as f:
+                f.write('# edited\n')
+            p, output, stderr = clang2py(args)
+            self.assertNotIn('is up to date', stderr)
+            p, output, stderr = clang2py(args)
+            self.assertIn('is up to date', stderr)
+            # so is a changed library
+            with open(library, 'ab') as f:
+                f.write(b'\0')
+            p, output, stderr = clang2py(args)
+            self.assertNotIn('is up to date', stderr)
+
+    def test_manifest(self):
+        """run clang2py --manifest jobs.json"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = os.path.join(tmpdir, 'jobs.json')
+            jobs = [{'name': 'native', 'inputs': ['test/data/test-records.c'], 'output': os.path.join(tmpdir, 'native.py')},
+                    {'name': 'i386', 'args': ['-t', 'i386-linux'], 'inputs': ['test/data/test-records.c'],
+                     'output': os.path.join(tmpdir, 'i386.py')},
+                    {'name': 'name', 'args': ['-s', 'struct_Name'], 'inputs': ['test/data/test-records.c'],
+                     'output': os.path.join(tmpdir, 'name.py')}]
+            with open(manifest, 'w') as f:
+                json.dump({'args': ['-k', 's'], 'jobs': jobs}, f)
+            p, output, stderr = clang2py(['--manifest', manifest])
+            self.assertEqual(0, p.returncode)
+            self.assertIn('3 jobs, 0 failed', stderr)
+            # same as separate runs
+            for job in jobs:
+                p, output, stderr = clang2py(['-k', 's'] + job.get('args', []) + job['inputs'])
+                with open(job['output']) as f:
+                    self.assertEqual(output, f.read())
+            # a failed job does not stop the others
+            jobs.insert(0, {'name': 'missing', 'inputs': [os.path.join(tmpdir, 'missing.h')]})
+            with open(manifest, 'w') as f:
+                json.dump({'jobs': jobs}, f)
+            p, output, stderr = clang2py(['--manifest', manifest, '-j', '2'])
+            self.assertEqual(1, p.returncode)
+            self.assertIn('4 jobs, 1 failed', stderr)
+
+    def test_manifest_log_level(self):
+        """run clang2py --manifest jobs.json, with a --debug job in the same session as the others"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header = os.path.join(tmpdir, 'point.h')
+            with open(header, 'w') as f:
+                f.write('struct point { int x; int y; };\n')
+            jobs = [{'name': name, 'args': args, 'inputs': [header], 'output': os.path.join(tmpdir, name + '.py')}
+                    for name, args in [('default', []), ('debug', ['--debug']), ('quiet', ['-q'])]]
+            manifest = os.path.join(tmpdir, 'jobs.json')
+            with open(manifest, 'w') as f:
+                json.dump({'jobs': jobs}, f)
+            p, output, stderr = clang2py(['--manifest', manifest, '-j', '1'])
+            self.assertEqual(0, p.returncode)
+            # only the --debug job logs its debug messages
+            self.assertIn('DEBUG:codegen:Head start for struct_point', stderr)
+            self.assertEqual(1, stderr.count('DEBUG:codegen:Head start for struct_point'))
+
+    def test_manifest_targets(self):
+        """run clang2py --manifest jobs.json, with jobs of different targets in the same session"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header = os.path.join(tmpdir, 'long.h')
+            with open(header, 'w') as f:
+                f.write('struct s { long l; int i; };\n')
+            targets = ['i386-linux-gnu', 'x86_64-linux-gnu', 'i386-linux-gnu']
+            jobs = [{'name': str(i), 'args': ['-t', target], 'inputs': [header],
+                     'output': os.path.join(tmpdir, '%d.py' % i)} for i, target in enumerate(targets)]
+            manifest = os.path.join(tmpdir, 'jobs.json')
+            with open(manifest, 'w') as f:
+                json.dump({'jobs': jobs}, f)
+            p, output, stderr = clang2py(['--manifest', manifest, '-j', '1'])
+            self.assertEqual(0, p.returncode)
+            # each job has the type sizes of its own target
+            for job, width in zip(jobs, ['c_int32', 'c_int64', 'c_int32']):
+                with open(job['output']) as f:
+                    self.assertIn("('l', ctypes.%s)" % width, f.read())
+
+    def test_serve(self):
+        """run clang2py --serve socket, and clang2py-client"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'clang2py.sock')
+            server = subprocess.Popen([sys.executable, clang2py_path, '--serve', path, '-j', '1', '--idle-timeout', '2'],
+                                      stderr=subprocess.PIPE)
+            try:
+                for _ in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.1)
+                client = [sys.executable, '-m', 'ctypeslib.client']
+                with unittest.mock.patch.dict(os.environ, {'CLANG2PY_SOCKET': path}):
+                    p, output, stderr = run(client + ['test/data/test-records.c', '-k', 's'])
+                    self.assertEqual(0, p.returncode)
+                    self.assertEqual(clang2py(['test/data/test-records.c', '-k', 's'])[1], output)
+                    p, output, stderr = run(client + ['test/data/missing.h'])
+                    self.assertEqual(2, p.returncode)
+                    self.assertIn("can't open 'test/data/missing.h'", stderr)
+                    p, output, stderr = run(client + ['--server-stats'])
+                    self.assertEqual({'ok': 1, 'failed': 1}, json.loads(output)['requests'])
+                # exits when idle
+                self.assertEqual(0, server.wait(timeout=30))
+                self.assertFalse(os.path.exists(path))
+            finally:
+                if server.poll() is None:
+                    server.kill()
+                server.stderr.close()
+            # without a daemon, the client runs clang2py
+            with unittest.mock.patch.dict(os.environ, {'CLANG2PY_SOCKET': path}):
+                p, output, stderr = run([sys.executable, '-m', 'ctypeslib.client', 'test/data/test-records.c', '-k', 's'])
+            self.assertEqual(0, p.returncode)
+            self.assertIn('class struct_Name(', output)
+            # a daemon that does not answer in time, the client runs clang2py
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+                listener.bind(path)
+                listener.listen(1)
+                with unittest.mock.patch.dict(os.environ, {'CLANG2PY_SOCKET': path}):
+                    start = time.monotonic()
+                    p, output, stderr = run([sys.executable, '-m', 'ctypeslib.client', '--client-timeout', '0.5',
+                                             'test/data/test-records.c', '-k', 's'])
+            self.assertEqual(0, p.returncode)
+            self.assertIn('class struct_Name(', output)
+            self.assertLess(time.monotonic() - start, 30)
+
+    def test_serve_broken_pool(self):
+        """a request whose worker died fails, and the workers are restarted"""
+        server = ctypeslib.clang2py.Server('unused.sock', 1, 4, 0)
+        broken = unittest.mock.Mock()
+        broken.submit.side_effect = concurrent.futures.process.BrokenProcessPool('a worker died')
+        server.executor = broken
+        reply = server._reply({'argv': ['test/data/test-records.c'], 'cwd': os.getcwd()})
+        try:
+            self.assertEqual(1, reply['exit'])
+            self.assertIn('a worker died', reply['stderr'])
+            self.assertEqual({'failed': 1}, server.stats()['requests'])
+            self.assertEqual(0, server.active)
+            broken.shutdown.assert_called_once_with(wait=False)
+            self.assertIsInstance(server.executor, concurrent.futures.ProcessPoolExecutor)
+        finally:
+            if server.executor is not broken:
+                server.executor.shutdown(wait=True)
+
+    def test_watch(self):
+        """run clang2py --watch, and change an included header"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header, source = os.path.join(tmpdir, 'point.h'), os.path.join(tmpdir, 'shape.h')
+            output = os.path.join(tmpdir, 'shape.py')
+            with open(header, 'w') as f:
+                f.write('struct point { int x; int y; };\n')
+            with open(source, 'w') as f:
+                f.write('#include "point.h"\nstruct shape { struct point center; };\n')
+            watcher = subprocess.Popen([sys.executable, clang2py_path, '-i', source, '-o', output, '--watch',
+                                        '--watch-interval', '0.1'], stderr=subprocess.PIPE)
+            try:
+                for _ in range(300):
+                    if os.path.exists(output):
+                        break
+                    time.sleep(0.1)
+                with open(header, 'w') as f:
+                    f.write('struct point { int x; int y; int z; };\n')
+                for _ in range(300):
+                    with open(output) as f:
+                        generated = f.read()
+                    if "('z', " in generated:
+                        break
+                    time.sleep(0.1)
+                self.assertEqual(clang2py(['-i', source])[1], generated)
+                watcher.send_signal(signal.SIGINT)
+                self.assertEqual(0, watcher.wait(timeout=30))
+            finally:
+                if watcher.poll() is None:
+                    watcher.kill()
+                watcher.stderr.close()
+
     def test_stdin_succeed(self):
         """Support of stdin is done """
         # run cat  test/data/test-includes.h | clang2py -
@@ -1,4 +1,7 @@
 import io
+import os
+import tempfile
+import unittest.mock
 
 from test.util import ClangTest
 from ctypeslib.codegen import clangparser
@@ -49,3 +52,53 @@ struct example {
         with self.assertRaises(InvalidTranslationUnitException):
             self.parser.parse('test/data/test-error1.c')
 
+
+    def test_get_result_incremental(self):
+        self.parser.parse_string("struct first { int a; };")
+        first = self.parser.get_result()
+        self.assertEqual(['struct_first'], [i.name for i in first])
+        self.parser.parse_string("struct second { int b; };")
+        second = self.parser.get_result()
+        # only the newly registered items are returned
+        self.assertEqual(['struct_second'], [i.name for i in second])
+        self.assertEqual([], self.parser.get_result())
+        self.assertTrue(self.parser.is_registered('struct_first'))
+
+    def test_get_result_redefined_macro(self):
+        self.parser.activate_macros_parsing()
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, value, struct in [('a.h', 1, 'first'), ('b.h', 2, 'second')]:
+                with open(os.path.join(tmp, name), 'w') as f:
+                    f.write("#define A %d\nstruct %s { int a; };\n" % (value, struct))
+            self.parser.parse(os.path.join(tmp, 'a.h'))
+            self.assertEqual(['A', 'struct_first'], [i.name for i in self.parser.get_result()])
+            self.parser.parse(os.path.join(tmp, 'b.h'))
+            # the redefinition replaces the registered macro, without returning its name again
+            self.assertEqual(['struct_second'], [i.name for i in self.parser.get_result()])
+            self.assertEqual('2', self.parser.get_registered('A').body)
+
+    def test_get_result_cpp_data_incremental(self):
+        self.parser.cpp_data["functions"] = ["F(x) x + 1\n"]
+        with unittest.mock.patch.object(self.parser, "replace_registered",
+                                        wraps=self.parser.replace_registered) as replace:
+            self.parser.get_result()
+            self.parser.cpp_data["functions"].append("G(y) y\n")
+            self.parser.get_result()
+        # each macro line is handled once
+        self.assertEqual(['F', 'G'], [c.args[0] for c in replace.call_args_list])
+
+    def test_register_usr_merge(self):
+        header = """
+struct shared { int a; };
+typedef struct shared shared_t;
+int use_shared(shared_t *s);
+"""
+        self.parser.parse_string(header)
+        first = self.parser.get_result()
+        self.assertEqual(['struct_shared', 'shared_t', 'use_shared'], [i.name for i in first])
+        struct = self.parser.get_registered('struct_shared')
+        self.assertIs(struct, self.parser.get_registered_usr('c:@S@shared'))
+        # the same declarations from another translation unit are merged
+        self.parser.parse_string(header + "int other(void);")
+        self.assertIs(struct, self.parser.get_registered_usr('c:@S@shared'))
+        self.assertEqual(['other'], [i.name for i in self.parser.get_result()])
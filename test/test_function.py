@@ -1,8 +1,18 @@
 import unittest
+import concurrent.futures
 import ctypes
-
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+
+import ctypeslib
+from ctypeslib import elf
+from ctypeslib.codegen import config
 from ctypeslib.codegen.util import get_cursor
 from ctypeslib.codegen.util import get_tu
+from ctypeslib.library import Library, LibraryIndex, SymbolCache, shared_library
 from test.util import ClangTest
 
 """Test if functions are correctly generated.
@@ -70,6 +80,107 @@ void    log_print(const char * module, int options, int severity, const char * c
         self.assertIn('log_print', self.namespace)
         self.assertIn('log_print', self.text_output)
 
+    def test_lazy_function_with_dll(self):
+        cfg = config.CodegenConfig()
+        cfg.lazy_functions = True
+        cfg.generate_docstrings = True
+        cfg.searched_dlls = [Library('test/data/test-callbacks.so', nm="nm")]
+        namespace = ctypeslib.translate('''int twice(int i);''', cfg=cfg)
+        # only a signature table entry until the first access
+        self.assertNotIn('twice', namespace)
+        self.assertIn('twice', namespace['_lazy_functions'])
+        self.assertEqual(42, namespace.twice(21))
+        self.assertEqual([ctypes.c_int32], namespace.twice.argtypes)
+        self.assertIn('c_int32 twice(c_int32 i)', namespace.twice.__doc__)
+        self.assertIn('twice', namespace)
+
+    def test_lazy_library(self):
+        cfg = config.CodegenConfig()
+        cfg.lazy_functions = True
+        cfg.lazy_libraries = True
+        cfg.searched_dlls = [Library('test/data/test-callbacks.so', nm="nm")]
+        cfg.preloaded_dlls = ['libm.so.6']
+        namespace = ctypeslib.translate('''int twice(int i);''', cfg=cfg)
+        library = namespace['_libraries']['test-callbacks.so']
+        # not loaded until the first function is bound
+        self.assertIsNone(library._library)
+        self.assertEqual(['libm.so.6'], namespace['LazyLibrary']._preloads)
+        self.assertEqual(42, namespace.twice(21))
+        self.assertIsNotNone(library._library)
+        self.assertTrue(namespace['LazyLibrary']._preloaded)
+
+    def test_library_index_precedence(self):
+        first = Library('test/data/test-callbacks.so', nm="nm")
+        second = Library('test/data/test-callbacks.so', nm="nm")
+        index = LibraryIndex([first, second])
+        self.assertIs(first, index.find('twice'))
+        self.assertIsNone(index.find('not_a_symbol'))
+        # a library that cannot list its symbols is probed at its position
+        cdll = ctypes.CDLL('test/data/test-callbacks.so')
+        self.assertIs(cdll, LibraryIndex([cdll, first]).find('twice'))
+        self.assertIs(first, LibraryIndex([first, cdll]).find('twice'))
+
+    def test_library_elf_symbols(self):
+        library = Library('test/data/test-callbacks.so', nm="nm")
+        symbols = elf.dynamic_symbols('test/data/test-callbacks.so')
+        self.assertEqual(['call_cbs', 'call_func', 'get_func_ptr', 'ptwice', 'twice'], sorted(symbols))
+        # same as nm
+        self.assertEqual(symbols, library._symbols())
+        self.assertEqual(symbols, Library._get_nm_symbols('test/data/test-callbacks.so', "nm"))
+        with self.assertRaises(elf.ELFError):
+            elf.dynamic_symbols('test/data/test-callbacks.c')
+
+    def test_library_symbol_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shutil.copy('test/data/test-callbacks.so', directory)
+            filepath = os.path.join(directory, 'test-callbacks.so')
+            cache = SymbolCache(os.path.join(directory, 'cache'))
+            self.assertIsNone(cache.load(filepath, "nm"))
+            library = Library(filepath, nm="nm", cache=cache)
+            self.assertEqual(library._symbols(), cache.load(filepath, "nm"))
+            with mock.patch.object(Library, '_get_symbols', side_effect=AssertionError):
+                self.assertEqual(library.twice, Library(filepath, nm="nm", cache=cache).twice)
+            # a modified library invalidates its entry
+            os.utime(filepath, ns=(0, 0))
+            self.assertIsNone(cache.load(filepath, "nm"))
+            self.assertEqual(library._symbols(), Library(filepath, nm="nm", cache=cache)._symbols())
+
+    def test_library_lazy_symbols(self):
+        with mock.patch.object(Library, '_get_symbols', side_effect=AssertionError):
+            # nothing is extracted before the first lookup
+            library = Library('test/data/test-callbacks.so', nm="nm")
+        self.assertIsNotNone(library.twice)
+        self.assertIs(library, LibraryIndex([library]).find('call_cbs'))
+        # a failed extraction raises on lookup
+        failed = Library('test/data/test-callbacks.c', nm="false")
+        with self.assertRaises(subprocess.CalledProcessError):
+            failed.twice
+
+    def test_library_prefetch(self):
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            library = Library('test/data/test-callbacks.so', nm="nm")
+            library.prefetch(executor)
+            self.assertIsNone(library._pending.exception())
+            with mock.patch.object(Library, '_load_symbols', side_effect=AssertionError):
+                # the lookup takes the symbols extracted in the pool
+                self.assertEqual(elf.dynamic_symbols('test/data/test-callbacks.so'), library._symbols())
+            # a failed extraction raises on lookup
+            failed = Library('test/data/test-callbacks.c', nm="false")
+            failed.prefetch(executor)
+            with self.assertRaises(subprocess.CalledProcessError):
+                failed.twice
+
+    def test_shared_library(self):
+        with tempfile.TemporaryDirectory() as directory:
+            shutil.copy('test/data/test-callbacks.so', directory)
+            filepath = os.path.join(directory, 'test-callbacks.so')
+            library = shared_library(filepath)
+            self.assertIs(library, shared_library(filepath))
+            self.assertIsNot(library, shared_library(filepath, nm="false"))
+            # a modified library is loaded again
+            os.utime(filepath, ns=(0, 0))
+            self.assertIsNot(library, shared_library(filepath))
+
 #     def test_function_return_enum(self):
 #         flags = ['-target', 'i386-linux']
 #         self.convert('''
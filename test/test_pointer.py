@@ -1,6 +1,11 @@
+import io
 import unittest
 import ctypes
+from unittest import mock
 
+import ctypeslib
+from ctypeslib.codegen import codegenerator
+from ctypeslib.codegen import config
 from test.util import ClangTest
 
 '''Test if pointers are correctly generated in structures for different target
@@ -44,6 +49,54 @@ class Pointer(ClangTest):
         self.assertNotIn('POINTER_T', self.text_output)
         # self.assertIn('POINTER_T', self.text_output)
 
+    def test_hoist_types(self):
+        source = '''
+        struct node {
+            struct node *next;
+            struct node *prev;
+            char name[16];
+            int (*cb)(struct node *, int);
+        };
+        struct node *head(struct node *n);
+        struct node *tail(struct node *n);
+        int (*handler(int (*cb)(struct node *, int)))(struct node *, int);
+        int (*other(int (*cb)(struct node *, int)))(struct node *, int);
+        int once[3];
+        '''
+        cfg = config.CodegenConfig()
+        cfg.hoist_types = True
+        output = io.StringIO()
+        ctypeslib.translate(source, outfile=output, cfg=cfg)
+        text = output.getvalue()
+        # expressions written often enough are declared once, and referred to by a name derived from the type
+        self.assertEqual(1, text.count('ctypes.POINTER(struct_node)'))
+        self.assertEqual(1, text.count('ctypes.CFUNCTYPE(ctypes.c_int32'))
+        self.assertIn('_fn_c_int32__ptr_struct_node_c_int32 = ctypes.CFUNCTYPE(', text)
+        # the others are not, as an alias would make the module bigger
+        self.assertNotIn('_arr_c_int32_3', text)
+        self.assertIn("('name', ctypes.c_char * 16)", text)
+        namespace = ctypeslib.translate(source, cfg=cfg)
+        self.assertIs(namespace._ptr_struct_node, ctypes.POINTER(namespace.struct_node))
+        self.assertEqual(16, namespace.struct_node.name.size)
+        self.assertNotIn('_ptr_struct_node', namespace['__all__'])
+
+    def test_type_name_memo(self):
+        translator = codegenerator.CodeTranslator(config.CodegenConfig())
+        translator.parse_input_string('''
+        int first(char *a, char *b);
+        int second(char *c);
+        ''')
+        generator = translator.make_code_generator(io.StringIO())
+        generator.generate_headers(translator.parser)
+        functions = {f.name: f for f in translator.items if f.name in ('first', 'second')}
+        arg = functions['first'].arguments[0].typ
+        self.assertEqual('ctypes.POINTER(ctypes.c_char)', generator.type_name(arg))
+        # each use has its own type description, but the same expression
+        with mock.patch.object(generator, 'enable_pointer_type', side_effect=AssertionError):
+            for f in functions.values():
+                for a in f.arguments:
+                    self.assertEqual('ctypes.POINTER(ctypes.c_char)', generator.type_name(a.typ))
+
 
 if __name__ == "__main__":
     unittest.main()
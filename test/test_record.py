@@ -1,6 +1,8 @@
 import ctypes
 import unittest
 
+import ctypeslib
+from ctypeslib.codegen import config
 from test.util import ClangTest
 
 import logging
@@ -305,6 +307,38 @@ struct s {
         self.assertHasFieldNamed(self.namespace.union_s_u, 'l2')
         self.assertHasFieldNamed(self.namespace.union_s_u, 'f2')
 
+    def test_record_tables(self):
+        """Records built from a table have the same layout as records declared one by one"""
+        source = '''
+typedef int (*callback)(struct node *, void *);
+struct node {
+    struct node *next;
+    union {
+        long l;
+        float f;
+    };
+    char name[16];
+    unsigned int flags:3;
+    callback cb;
+};
+typedef struct node node_t;
+struct list {
+    node_t head;
+    struct node nodes[4];
+};
+'''
+        cfg = config.CodegenConfig()
+        cfg.record_tables = True
+        tables = ctypeslib.translate(source, cfg=cfg)
+        records = ctypeslib.translate(source)
+        for name in ['struct_node', 'union_node_0', 'struct_list']:
+            self.assertEqual(ctypes.sizeof(records[name]), ctypes.sizeof(tables[name]))
+            for field in records[name]._fields_:
+                self.assertEqual(getattr(records[name], field[0]).offset, getattr(tables[name], field[0]).offset)
+        self.assertIs(tables.node_t, tables.struct_node)
+        self.assertEqual(('_0',), tables.struct_node._anonymous_)
+        self.assertHasFieldNamed(tables.struct_node, 'l')
+
 
 if __name__ == "__main__":
     # logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
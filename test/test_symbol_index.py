@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from test.util import ClangTest, clang2py
+from ctypeslib.codegen import clangparser
+from ctypeslib.codegen.symbolindex import SymbolIndex
+
+
+class SymbolIndexTest(ClangTest):
+
+    def setUp(self):
+        self.parser = clangparser.Clang_Parser([])
+        handle, self.index_name = tempfile.mkstemp(".sqlite")
+        os.close(handle)
+
+    def tearDown(self):
+        os.unlink(self.index_name)
+
+    def _index(self, source_code):
+        self.parser.parse_string(source_code)
+        self.parser.get_result()
+        return SymbolIndex.create(self.index_name, self.parser.all.values())
+
+    def test_lookup(self):
+        with self._index("""
+struct point { int x; int y; };
+typedef struct point point_t;
+int distance(point_t *a, struct point *b);
+""") as index:
+            (row,) = index.lookup('struct_point')
+            self.assertEqual(('struct_point', 'Structure'), row[:2])
+            self.assertEqual(8, row[4])
+            self.assertEqual([('x', 'c_int32', 0, 32), ('y', 'c_int32', 32, 32)], index.fields('struct_point'))
+            self.assertEqual(['struct_point'], [r[0] for r in index.with_field('y')])
+            self.assertEqual(['distance'], [r[0] for r in index.taking('struct_point')])
+            self.assertEqual(['distance'], [r[0] for r in index.taking('struct_point *')])
+            self.assertEqual(['point_t', 'distance'], [r[0] for r in index.users('struct_point')])
+            self.assertEqual([], index.lookup('struct_point', 'Function'))
+
+
+class QueryCommandTest(ClangTest):
+
+    def test_query(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_name = os.path.join(tmpdir, 'index.sqlite')
+            p, output, stderr = clang2py(['test/data/test-records.c', '--index', index_name])
+            self.assertEqual(0, p.returncode)
+            p, output, stderr = clang2py(['query', index_name, '--field', 'member4'])
+            self.assertEqual(0, p.returncode)
+            self.assertIn("Structure struct_Name ", output)
+            self.assertIn("Structure struct_Name2 ", output)
+            p, output, stderr = clang2py(['query', index_name, '--name', 'struct_whatever'])
+            self.assertEqual(1, p.returncode)
+
+    def test_query_enum_value(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header, index_name = os.path.join(tmpdir, 'colors.h'), os.path.join(tmpdir, 'index.sqlite')
+            with open(header, 'w') as f:
+                f.write('enum color { RED, GREEN = 4 };\n')
+            p, output, stderr = clang2py([header, '--index', index_name])
+            self.assertEqual(0, p.returncode)
+            p, output, stderr = clang2py(['query', index_name, '-n', 'RED'])
+            self.assertEqual(0, p.returncode)
+            self.assertIn("EnumValue RED ", output)
+            self.assertIn("colors.h", output)
+
+
+if __name__ == "__main__":
+    unittest.main()